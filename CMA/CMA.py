@@ -12,11 +12,10 @@
 
 import configparser
 import importlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import math
 import numpy as np
-import matplotlib
 import cma
-import matplotlib.pyplot as plt
 
 
 def sigma_func(error_type, sigma_estimator, mean): #defining both the proporitonal and constant error
@@ -45,36 +44,237 @@ def log_total_prior(prior_set, estimators, time_instance): #the sum of all log p
 def ln_normal_probability_function(y, mean, sigma, theta): #evaluates my normal probability function for a given y, mean, and theta and sigma
 	return math.log((1.0/(math.sqrt(2*math.pi)*sigma)))+(-0.5*((((y - mean)/sigma))**2)) #log of normal pdf
 
+class LogPosterior():
+	"""Log-likelihood plus log-prior of the estimators (theta, sigma). Built once from the read_in() output:
+	the model module is imported once, the prior constants are precomputed and the data are kept as arrays.
+	If the model function accepts an array of time points the whole data set is evaluated in one NumPy pass.
+	If the module provides model_function_batch(thetas[N, d], t[M]) -> [N, M], batch() scores a whole
+	population with one call of the model."""
+	def __init__(self, y_data, t_data, error_type, prior_set, model_filename):
+		module = importlib.import_module(model_filename) #resolved once
+		self.model = module.model_function
+		self.model_batch = getattr(module, 'model_function_batch', None)
+		self.y = np.asarray(y_data, dtype=float)
+		self.t = np.asarray(t_data, dtype=float)
+		self.error_type = error_type
+		self.vectorized = None #detected on the first call
+
+		#uniform priors are constant, normal priors are evaluated on the estimators in normal_index
+		self.log_prior_const = 0.0
+		normal_index, normal_mean, normal_sigma = [], [], []
+		for i in range(len(prior_set)):
+			if (prior_set[i][0] == 'uniform'):
+				self.log_prior_const += log_uniform_prior(prior_set[i][1], prior_set[i][2])
+			elif (prior_set[i][0] == 'normal'):
+				normal_index.append(i)
+				normal_mean.append(prior_set[i][1])
+				normal_sigma.append(math.sqrt(prior_set[i][2])) #prior_set holds the variance
+		self.normal_index = np.array(normal_index, dtype=int)
+		self.normal_mean = np.array(normal_mean, dtype=float)
+		self.normal_sigma = np.array(normal_sigma, dtype=float)
+		self.log_prior_const -= np.sum(np.log(math.sqrt(2*math.pi)*self.normal_sigma))
+
+	def log_prior(self, estimators): #sum of all log priors, for estimators[d+1] or every row of estimators[N, d+1]
+		z = (np.asarray(estimators)[..., self.normal_index] - self.normal_mean)/self.normal_sigma
+		return self.log_prior_const - 0.5*np.sum(z**2, axis=-1)
+
+	def model_output(self, theta): #model function on all time points
+		if self.vectorized is None:
+			try:
+				mean = np.asarray(self.model(theta, self.t), dtype=float)
+				self.vectorized = mean.shape == self.t.shape
+			except Exception:
+				self.vectorized = False
+		if self.vectorized:
+			return np.asarray(self.model(theta, self.t), dtype=float)
+		return np.array([self.model(theta, t) for t in self.t], dtype=float)
+
+	def __call__(self, estimators):
+		theta = estimators[0:-1] #model parameter estimators
+		sigma_estimator = estimators[-1] #error estimator
+		mean = self.model_output(theta)
+		if (self.error_type == 'proportional'):
+			sigma = np.abs(sigma_estimator * mean)
+		else:
+			sigma = sigma_estimator
+		log_likelihood = np.sum(-np.log(math.sqrt(2*math.pi)*sigma) - 0.5*((self.y - mean)/sigma)**2)
+		return log_likelihood + self.log_prior(estimators)
+
+	def batch(self, estimators): #log-posterior of every row of estimators[N, d+1], returns array[N]
+		estimators = np.atleast_2d(np.asarray(estimators, dtype=float))
+		if self.model_batch is None:
+			return np.array([self(estimator) for estimator in estimators], dtype=float)
+		sigma_estimator = estimators[:, -1:] #error estimators, [N, 1]
+		mean = np.asarray(self.model_batch(estimators[:, 0:-1], self.t), dtype=float) #[N, M]
+		if (self.error_type == 'proportional'):
+			sigma = np.abs(sigma_estimator * mean)
+		else:
+			sigma = np.broadcast_to(sigma_estimator, mean.shape)
+		log_likelihood = np.sum(-np.log(math.sqrt(2*math.pi)*sigma) - 0.5*((self.y - mean)/sigma)**2, axis=1)
+		return log_likelihood + self.log_prior(estimators)
+
+
+_log_posteriors = {} #LogPosterior instances of maximum_likelihood_func_ln, keyed on model, data and priors
+
 def maximum_likelihood_func_ln(y, time_mesh, estimators, error_type, prior_set, model_filename): #defining my maximum likelihood function, which is a function of my estimators theta and sigma (the parameters I want to determine)
-	module = importlib.import_module(model_filename, 'model_function') #importing model function as module
-	theta = estimators[0:-1] #model parameter estimators
-	sigma_estimator = estimators[-1] #error estimator
-	likelihood_output = 0
-	for i in range(len(time_mesh)):
-		mean = module.model_function(theta, time_mesh[i]) #calculating the mean using the model function for the given estimators
-		sigma = sigma_func(error_type, sigma_estimator, mean) #calculating sigma using the definition of the error
-		likelihood_output = likelihood_output + ln_normal_probability_function(y[i],mean,sigma,theta) + log_total_prior(prior_set, estimators, time_mesh[i])
-	return likelihood_output
-
-def CMA(x_0, sigma_0, y_data, t_data, error_type, prior_set, lower_bound, upper_bound, model_filename):
+	key = (model_filename, error_type, repr(prior_set), np.asarray(y, dtype=float).tobytes(), np.asarray(time_mesh, dtype=float).tobytes())
+	if key not in _log_posteriors: #the model is imported and the priors are set up once per key
+		_log_posteriors[key] = LogPosterior(y, time_mesh, error_type, prior_set, model_filename)
+	return _log_posteriors[key](estimators)
+
+_worker = {} #per-process state of the process pool backend
+
+def init_worker(*log_posterior_args): #loads the model once per worker process
+	_worker['log_posterior'] = LogPosterior(*log_posterior_args)
+
+def worker_log_posterior(estimators):
+	return _worker['log_posterior'].batch(estimators)
+
+
+class Evaluator():
+	"""Evaluates the log-posterior of all candidates of a generation with the backend of cma.par:
+	serial, thread (a thread pool, for models that release the GIL) or process (a process pool,
+	the model is loaded once per worker)."""
+	def __init__(self, log_posterior, log_posterior_args, backend='serial', workers=1):
+		self.log_posterior = log_posterior
+		self.backend = backend
+		self.workers = workers
+		self.executor = None
+		if (backend == 'thread'):
+			self.executor = ThreadPoolExecutor(max_workers=workers)
+		elif (backend == 'process'):
+			self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=log_posterior_args)
+		elif (backend != 'serial'):
+			raise ValueError("unknown evaluation backend: " + backend)
+
+	def __call__(self, estimators): #array of log-posterior values in the order of estimators
+		estimators = np.asarray(estimators, dtype=float)
+		if self.executor is None:
+			return self.log_posterior.batch(estimators)
+		chunks = np.array_split(estimators, min(self.workers, len(estimators))) #one batch per worker
+		if (self.backend == 'process'):
+			return np.concatenate(list(self.executor.map(worker_log_posterior, chunks)))
+		return np.concatenate(list(self.executor.map(self.log_posterior.batch, chunks)))
+
+	def close(self):
+		if self.executor is not None:
+			self.executor.shutdown()
 
-	print("DONE")
 
-	es = cma.CMAEvolutionStrategy(x_0, sigma_0, {'bounds': [lower_bound, upper_bound]}) #optim instance is generated with starting point x0 = (0)^T and initial standard deviation sigma0 = 1
+def run_cma(x_0, sigma_0, lower_bound, upper_bound, evaluate, popsize=None, max_evaluations=None, log_interval=1, disp_interval=100, seed=0, log_prefix=None): #one CMA-ES run until es.stop()
+	options = {'bounds': [lower_bound, upper_bound], 'verb_log': log_interval, 'verb_disp': disp_interval} #0 = no log files, no display
+	if seed > 0:
+		options['seed'] = seed #0 = seeded from the clock
+	if log_prefix is not None:
+		options['verb_filenameprefix'] = log_prefix #log files of this run, e.g. outcmaes/run1_
+	if popsize is not None:
+		options['popsize'] = popsize
+	if max_evaluations is not None:
+		options['maxfevals'] = max_evaluations #remaining evaluation budget
+	es = cma.CMAEvolutionStrategy(x_0, sigma_0, options) #optim instance is generated with starting point x_0 and initial standard deviation sigma_0
 
 	while not es.stop(): #iterate
 		estiomators = es.ask() #ask delivers new candidate estimatior, estimators is a list or array of candidate estimator points
-		es.tell(estiomators, [-1*maximum_likelihood_func_ln(y_data, t_data, estimator, error_type, prior_set,model_filename) for estimator in estiomators]) #tell updates the optim instance by passing the respective function values
-		es.logger.add() #append some logging data from CMAEvolutionStrategy class instance es
-		es.disp() #displays selected data from the class
+		es.tell(estiomators, -1*evaluate(estiomators)) #tell updates the optim instance by passing the respective function values
+		if log_interval > 0 and es.countiter % log_interval == 0:
+			es.logger.add() #append some logging data from CMAEvolutionStrategy class instance es
+		if disp_interval > 0:
+			es.disp() #displays selected data from the class every disp_interval iterations
+	return es
 
 
+def plot_log(es, plot): #plot of the log files, plot is show (open a window) or the name of an image file
+	import matplotlib
+	if plot != 'show':
+		matplotlib.use('Agg') #no display needed
+	import matplotlib.pyplot as plt
+	es.logger.plot() #plots the results
+	if plot == 'show':
+		plt.show()
+	else:
+		plt.savefig(plot)
+		print("plot written to %s" % plot)
 
-	res = es.result
-	np.savetxt("cma_result.txt", res[0][:], newline='\n')
 
-	es.result_pretty() #print results
-	es.logger.plot() #plots the results
+def restart_schedule(strategy, n, incpopsize, sigma_0, evaluations_large, evaluations_small, large_runs, rng):
+	"""Population size, initial step size and regime ('large' or 'small') of the next restart.
+	ipop: the population grows by incpopsize with every restart.
+	bipop: alternates between the growing large population and a small population with a smaller,
+	random step size, whichever regime has used fewer evaluations so far. rng is a numpy Generator."""
+	default_popsize = 4 + int(3*math.log(n))
+	large_popsize = default_popsize * incpopsize**(large_runs + 1)
+	if (strategy == 'bipop' and evaluations_small < evaluations_large):
+		u = rng.uniform()
+		large_popsize = default_popsize * incpopsize**large_runs #largest population so far
+		popsize = max(2, int(default_popsize * (0.5*large_popsize/default_popsize)**(u**2)))
+		return popsize, sigma_0 * 10**(-2*u), 'small'
+	return large_popsize, sigma_0, 'large'
+
+
+def CMA(x_0, sigma_0, y_data, t_data, error_type, prior_set, lower_bound, upper_bound, model_filename, backend='serial', workers=1, restart_options=None, output_options=None):
+
+	print("DONE")
+
+	if restart_options is None:
+		restart_options = {'strategy': 'none', 'max_restarts': 0, 'max_evaluations': 0, 'incpopsize': 2, 'seed': 0}
+	strategy = restart_options['strategy']
+	seed = restart_options.get('seed', 0) #0 = not reproducible
+	rng = np.random.default_rng(seed if seed > 0 else None) #restart schedule and restart starting points
+	max_restarts = restart_options['max_restarts'] if strategy != 'none' else 0
+	budget = restart_options['max_evaluations'] #total over all runs, 0 = no limit
+	if output_options is None:
+		output_options = {'log_interval': 1, 'disp_interval': 100, 'plot': 'show'}
+	log_interval = output_options['log_interval']
+
+	log_posterior_args = (y_data, t_data, error_type, prior_set, model_filename)
+	log_posterior = LogPosterior(*log_posterior_args) #built once, reused for every evaluation
+	evaluate = Evaluator(log_posterior, log_posterior_args, backend, workers)
+
+	best = None #run with the best objective value
+	evaluations = 0
+	evaluations_large = 0
+	evaluations_small = 0
+	large_runs = 0
+	try:
+		for restart in range(max_restarts + 1):
+			if restart == 0: #first run from x_0 with the default population
+				popsize, sigma, regime, x_start = None, sigma_0, 'large', x_0
+			else: #restarts from a uniformly random point within the bounds
+				popsize, sigma, regime = restart_schedule(strategy, len(x_0), restart_options['incpopsize'],
+									sigma_0, evaluations_large, evaluations_small, large_runs, rng)
+				x_start = rng.uniform(lower_bound, upper_bound, len(x_0))
+			remaining = budget - evaluations if budget > 0 else None
+			log_prefix = 'outcmaes/run%d_' % restart if strategy != 'none' else None #every run keeps its own log files
+			es = run_cma(x_start, sigma, lower_bound, upper_bound, evaluate, popsize, remaining,
+						log_interval, output_options['disp_interval'], seed + restart if seed > 0 else 0, log_prefix)
+
+			evaluations += es.countevals
+			if regime == 'large':
+				evaluations_large += es.countevals
+				large_runs += 1 if restart > 0 else 0
+			else:
+				evaluations_small += es.countevals
+			if best is None or es.result.fbest < best.result.fbest:
+				best = es
+			if strategy != 'none':
+				print("run %d (%s regime): popsize = %d, evaluations = %d, best f = %g, overall best f = %g"
+					% (restart, regime, es.popsize, es.countevals, es.result.fbest, best.result.fbest))
+			if budget > 0 and evaluations >= budget:
+				print("evaluation budget of %d evaluations used" % budget)
+				break
+	finally:
+		evaluate.close()
+
+
+
+	res = best.result
+	np.savetxt("cma_result.txt", res[0][:], newline='\n')
+	np.savez("cma_result.npz", x_0=res.xbest, sigma_0=sigma_0, sigma_final=best.sigma, f_best=res.fbest, evaluations=evaluations) #checkpoint for a warm start, which starts with the initial step size: the final one is too small to explore
 
+	best.result_pretty() #print results
 
-	matplotlib.pyplot.show('hold')
+	if output_options['plot'] != 'none':
+		if log_interval > 0:
+			plot_log(best, output_options['plot']) #log files of the run with the best objective value
+		else:
+			print("no plot, logging is off (log_interval = 0)")
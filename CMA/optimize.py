@@ -14,6 +14,7 @@ from read_in import read_in
 from CMA import CMA
 
 
-parameters = read_in( )
+if __name__ == '__main__':
+	parameters = read_in( )
 
-CMA(*parameters)
+	CMA(*parameters)
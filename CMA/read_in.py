@@ -82,4 +82,50 @@ def read_in():
 	sigma_0 = float(sigma_0.split(' ')[0])
 
 
-	return (x_0, sigma_0, y_data, t_data, error_type, prior_set, lower_bound, upper_bound, model_filename)
+	#optional: evaluation backend of the candidates of a generation, serial, thread or process
+	backend = config_cma_par.get('EVALUATION', 'backend', fallback='serial').split('#')[0].strip()
+	workers = int(config_cma_par.get('EVALUATION', 'workers', fallback='1').split('#')[0])
+	if(backend not in ['serial', 'thread', 'process']):
+		print ("unknown evaluation backend: " + backend)
+		raise()
+
+
+	#optional: restart strategy none, ipop or bipop with a global budget of objective evaluations
+	restart_options = {}
+	restart_options['strategy'] = config_cma_par.get('RESTARTS', 'strategy', fallback='none').split('#')[0].strip()
+	restart_options['max_restarts'] = int(config_cma_par.get('RESTARTS', 'max_restarts', fallback='9').split('#')[0])
+	restart_options['max_evaluations'] = int(config_cma_par.get('RESTARTS', 'max_evaluations', fallback='0').split('#')[0])
+	restart_options['incpopsize'] = int(config_cma_par.get('RESTARTS', 'incpopsize', fallback='2').split('#')[0])
+	restart_options['seed'] = int(config_cma_par.get('RESTARTS', 'seed', fallback='0').split('#')[0])
+	if(restart_options['strategy'] not in ['none', 'ipop', 'bipop']):
+		print ("unknown restart strategy: " + restart_options['strategy'])
+		raise()
+
+	#optional: warm start x_0 (and sigma_0) from a previous cma_result.txt or cma_result.npz
+	warm_start = config_cma_par.get('RESTARTS', 'warm_start', fallback='').split('#')[0].strip()
+	if warm_start:
+		x_0, sigma_0 = load_warm_start(warm_start, x_0, sigma_0)
+
+
+	#optional: logging, display and plotting, defaults as in an interactive run
+	output_options = {}
+	output_options['log_interval'] = int(config_cma_par.get('OUTPUT', 'log_interval', fallback='1').split('#')[0])
+	output_options['disp_interval'] = int(config_cma_par.get('OUTPUT', 'disp_interval', fallback='100').split('#')[0])
+	output_options['plot'] = config_cma_par.get('OUTPUT', 'plot', fallback='show').split('#')[0].strip()
+
+
+	return (x_0, sigma_0, y_data, t_data, error_type, prior_set, lower_bound, upper_bound, model_filename, backend, workers, restart_options, output_options)
+
+
+def load_warm_start(filename, x_0, sigma_0): #x_0 from a result file, x_0 and sigma_0 from an .npz checkpoint
+	if filename.endswith('.npz'):
+		with np.load(filename) as checkpoint:
+			x_start = np.array(checkpoint['x_0'], dtype=float)
+			sigma_0 = float(checkpoint['sigma_0'])
+	else:
+		x_start = np.atleast_1d(np.loadtxt(filename))
+	if len(x_start) != len(x_0):
+		print("warm start %s holds %d instead of %d parameters" % (filename, len(x_start), len(x_0)))
+		raise()
+	print("warm start from %s" % filename)
+	return x_start, sigma_0
@@ -0,0 +1,82 @@
+# *
+# *  jit.py
+# *  PyPi4U
+# *
+# *  Authors:
+# *     Philipp Mueller  - muellphi@ethz.ch
+# *     Georgios Arampatzis - arampatzis@collegium.ethz.ch
+# *     Panagiotis Chatzidoukas
+# *  Copyright 2018 ETH Zurich. All rights reserved.
+# *
+
+
+from math import log, pi
+from timeit import default_timer as timer
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def compile_loglikelihood(m_func, t, d, sigma, alpha, beta, gamma, theta):
+    """ Compile the model function together with the Gaussian log-likelihood
+        loop over the data into native kernels with numba.
+
+        m_func(theta, t) is called with a scalar time point. The kernels are
+        compiled by a warm-up call at theta. Returns the kernels
+        loglik(theta[d]) and loglik_batch(thetas[N, d]) and the compile time
+        in seconds, or None if numba is not available or the model cannot be
+        compiled. """
+    if numba is None:
+        print("JIT: numba is not available, using the Python model.")
+        return None
+
+    t = np.ascontiguousarray(t, dtype=np.float64)
+    d = np.ascontiguousarray(d, dtype=np.float64)
+    sigma = float(sigma)
+    alpha = float(alpha)
+    beta = float(beta)
+    gamma = float(gamma)
+    proportional = gamma != 0 and alpha != 0
+    if alpha != 0:
+        volatility = ((alpha + beta) * sigma)**2
+    else:
+        volatility = (beta * sigma)**2
+    log_2pi = log(2*pi)
+
+    try:
+        model = numba.njit(m_func)
+    except Exception as e:
+        print("JIT: model function could not be compiled (" + str(e) + ").")
+        return None
+
+    @numba.njit
+    def loglik(theta):
+        res = 0.0
+        vol = volatility
+        for i in range(t.shape[0]):
+            f = model(theta, t[i])
+            if proportional:
+                vol = ((alpha * abs(f) ** gamma + beta) * sigma)**2
+            res -= (d[i] - f)**2 / (2*vol) + 0.5 * (log_2pi + np.log(vol))
+        return res
+
+    @numba.njit
+    def loglik_batch(thetas):
+        res = np.empty(thetas.shape[0])
+        for k in range(thetas.shape[0]):
+            res[k] = loglik(thetas[k])
+        return res
+
+    theta = np.ascontiguousarray(theta, dtype=np.float64)
+    start = timer()
+    try:
+        loglik(theta)
+        loglik_batch(theta.reshape(1, -1))
+    except Exception as e:
+        print("JIT: model function could not be compiled (" +
+              str(e).splitlines()[0] + "), using the Python model.")
+        return None
+    return loglik, loglik_batch, timer() - start
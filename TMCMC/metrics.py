@@ -0,0 +1,98 @@
+# *
+# *  metrics.py
+# *  PyPi4U
+# *
+# *  Authors:
+# *     Philipp Mueller  - muellphi@ethz.ch
+# *     Georgios Arampatzis - arampatzis@collegium.ethz.ch
+# *     Panagiotis Chatzidoukas
+# *  Copyright 2018 ETH Zurich. All rights reserved.
+# *
+
+
+import csv
+import json
+import os
+from timeit import default_timer as timer
+
+
+# Parts of a generation whose wall time is measured
+categories = ('likelihood', 'prior', 'proposal', 'statistics', 'io')
+
+
+class Timers():
+    """ Wall time per category and number of model evaluations since the
+        last reset. Every process has its own instance, timers; the worker
+        processes send theirs back with the samples. """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = dict.fromkeys(categories, 0.0)
+        self.evaluations = 0
+
+    def add(self, category, seconds):
+        self.times[category] += seconds
+
+    def state(self):
+        return dict(self.times), self.evaluations
+
+    def merge(self, state):
+        """ Add the state of the timers of another process """
+        times, evaluations = state
+        for category in categories:
+            self.times[category] += times[category]
+        self.evaluations += evaluations
+
+
+timers = Timers()
+
+
+class TimedLikelihood():
+    """ Forward single and batch calls to loglikelihood, count the model
+        evaluations and add their time to timers. """
+    def __init__(self, loglikelihood):
+        self.loglikelihood = loglikelihood
+
+    def __call__(self, theta):
+        start = timer()
+        value = self.loglikelihood(theta)
+        timers.add('likelihood', timer() - start)
+        timers.evaluations += 1
+        return value
+
+    def batch(self, thetas):
+        start = timer()
+        values = self.loglikelihood.batch(thetas)
+        timers.add('likelihood', timer() - start)
+        timers.evaluations += len(values)
+        return values
+
+
+class MetricsWriter():
+    """ One record per generation, as JSON lines (fmt='jsonl') or as rows of
+        a CSV file (fmt='csv'). With append the records are added to an
+        existing file, e.g. for a resumed run. """
+    def __init__(self, filename, fmt='jsonl', append=False):
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError("Metrics format " + fmt + " not recognised.")
+        self.fmt = fmt
+        self.header = not (append and os.path.exists(filename) and
+                           os.path.getsize(filename) > 0)
+        self.file = open(filename, 'a' if append else 'w', newline='')
+        self.writer = None
+
+    def write(self, record):
+        if self.fmt == 'jsonl':
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file,
+                                             fieldnames=list(record))
+                if self.header:
+                    self.writer.writeheader()
+            self.writer.writerow(record)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
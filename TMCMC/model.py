@@ -1,6 +1,15 @@
-import math
+import numpy as np
 
 
 def model_function(theta, time):
-   """Evaluates the model function for a given theta and time."""
-   return time*theta[2]*math.cos(theta[0]*time) + theta[1]*math.sin(time)
+   """Evaluates the model function for a given theta and time. time can be
+   a scalar or an array of time points."""
+   return time*theta[2]*np.cos(theta[0]*time) + theta[1]*np.sin(time)
+
+
+def model_function_batch(thetas, time):
+   """Evaluates the model function for every row of thetas[N, 3] on the time
+   array time[M], returns an array of shape [N, M]."""
+   thetas = np.atleast_2d(thetas)
+   return (time*thetas[:, 2:3]*np.cos(thetas[:, 0:1]*time) +
+           thetas[:, 1:2]*np.sin(time))
@@ -0,0 +1,184 @@
+# *
+# *  output.py
+# *  PyPi4U
+# *
+# *  Authors:
+# *     Philipp Mueller  - muellphi@ethz.ch
+# *     Georgios Arampatzis - arampatzis@collegium.ethz.ch
+# *     Panagiotis Chatzidoukas
+# *  Copyright 2018 ETH Zurich. All rights reserved.
+# *
+
+
+import queue
+import threading
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def generation_name(Gen):
+    return "curgen_db_" + "{0:0=3d}".format(Gen)
+
+
+class TextSampleWriter():
+    """ One text file curgen_db_GEN.txt per generation, a row holds the
+        sample followed by its log-likelihood. """
+    def write(self, Gen, points, F):
+        np.savetxt(generation_name(Gen) + ".txt", np.column_stack((points, F)),
+                   fmt="%.17g")
+
+    def close(self):
+        return None
+
+
+class NpySampleWriter():
+    """ One binary curgen_db_GEN.npy file per generation with the same
+        layout as the text files. The files can be memory-mapped with
+        np.load(file, mmap_mode='r'). """
+    def write(self, Gen, points, F):
+        out = np.lib.format.open_memmap(generation_name(Gen) + ".npy",
+                                        mode="w+", dtype=np.float64,
+                                        shape=(len(F), points.shape[1] + 1))
+        out[:, :-1] = points
+        out[:, -1] = F
+        out.flush()
+        del out
+
+    def close(self):
+        return None
+
+
+class HDF5SampleWriter():
+    """ A single HDF5 file holding every generation as a chunked dataset
+        named curgen_db_GEN. Requires h5py. """
+    def __init__(self, filename):
+        if h5py is None:
+            raise ImportError("h5py is required for the hdf5 output format.")
+        self.file = h5py.File(filename, "a")
+
+    def write(self, Gen, points, F):
+        name = generation_name(Gen)
+        if name in self.file:
+            del self.file[name]     # overwritten after a resumed run
+        dset = self.file.create_dataset(name, shape=(len(F),
+                                        points.shape[1] + 1),
+                                        dtype=np.float64, chunks=True)
+        dset[:, :-1] = points
+        dset[:, -1] = F
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SampleWriters():
+    """ Forward every generation to a list of sample writers. """
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, Gen, points, F):
+        for writer in self.writers:
+            writer.write(Gen, points, F)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class AsyncWriter():
+    """ Run output tasks in a background thread so the sampler does not wait
+        for the disk. Tasks are executed in submission order. The queue is
+        bounded, submit blocks if maxsize tasks are pending. An exception in
+        a task is raised again by the next submit, flush or close. """
+    def __init__(self, maxsize=2):
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+            func, args = task
+            if self.error is None:
+                try:
+                    func(*args)
+                except BaseException as e:
+                    self.error = e
+            self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, func, *args):
+        self.check()
+        self.queue.put((func, args))
+
+    def flush(self):
+        """ Wait until all submitted tasks are done """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """ Finish all submitted tasks and stop the thread """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
+
+
+class SyncWriter():
+    """ Same interface as AsyncWriter, tasks run immediately. """
+    def submit(self, func, *args):
+        func(*args)
+
+    def flush(self):
+        return None
+
+    def close(self):
+        return None
+
+
+def make_sample_writer(sample_format, text_export=False,
+                       hdf5_file="tmcmc_samples.h5"):
+    """ Sample writer for the format npy, hdf5 or text, optionally with an
+        additional text export. """
+    if sample_format == "npy":
+        writers = [NpySampleWriter()]
+    elif sample_format == "hdf5":
+        writers = [HDF5SampleWriter(hdf5_file)]
+    elif sample_format == "text":
+        writers = [TextSampleWriter()]
+    else:
+        raise ValueError("Sample format " + sample_format + " not recognised.")
+    if text_export and sample_format != "text":
+        writers.append(TextSampleWriter())
+    return SampleWriters(writers)
+
+
+def load_samples(filename, generation=None):
+    """ Read the samples of a generation written by one of the writers.
+        .npy files are memory-mapped. For HDF5 files the last generation is
+        read if generation is None. """
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode="r")
+    if filename.endswith(".h5") or filename.endswith(".hdf5"):
+        if h5py is None:
+            raise ImportError("h5py is required to read HDF5 files.")
+        with h5py.File(filename, "r") as f:
+            if generation is None:
+                # by number, curgen_db_1000 sorts before curgen_db_999
+                name = max(f.keys(), key=lambda key: int(key.split("_")[-1]))
+            else:
+                name = generation_name(generation)
+            return f[name][()]
+    return np.loadtxt(filename)
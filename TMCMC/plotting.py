@@ -15,6 +15,7 @@ import matplotlib.mlab as mlab
 import matplotlib.pyplot as plt
 import scipy.interpolate
 import argparse
+from output import load_samples
 
 
 def plot_histogram(ax, theta):
@@ -78,8 +79,8 @@ def plot_lower_triangle(ax, theta):
                 ax[i, j].set_yticklabels([])
 
 
-def plot_theta(file, likelihood=False):
-    theta = np.loadtxt(file)
+def plot_theta(file, likelihood=False, generation=None):
+    theta = load_samples(file, generation)
     fig, ax = plt.subplots(theta.shape[1]-1, theta.shape[1]-1)
     plot_histogram(ax, theta[:, :-1])
     if likelihood:
@@ -98,5 +99,8 @@ if __name__ == '__main__':
                         ' for plotting.')
     parser.add_argument("-lik", "--likelihood", action="store_true",
                         help="Plot log-likelihood value")
+    parser.add_argument("-g", "--generation", type=int, default=None,
+                        help="Generation to plot from an HDF5 file " +
+                        "(default: last)")
     args = parser.parse_args()
-    plot_theta(args.filename, args.likelihood)
+    plot_theta(args.filename, args.likelihood, args.generation)
@@ -10,9 +10,11 @@
 # *
 
 
-from random_auxiliary import uniformrand
-from math import log
-from scipy import optimize, random, stats
+from random_auxiliary import (get_generator, lognormalrand, normalrand,
+                              uniformrand)
+from math import exp, log, pi
+import numpy as np
+from scipy import optimize, special, stats
 
 
 class UniformPrior():
@@ -39,10 +41,11 @@ class NormalPrior():
 
     def sample(self):
         """ Sample with mean mu and variance sigma  """
-        return random.normal(self.mu, self.sigma, 1)
+        return normalrand(self.mu, self.sigma, 1)
 
     def logpriorpdf(self, x):
-        return stats.lognorm.pdf(x, s=self.sigma, scale=exp(self.mu))
+        return (-0.5 * ((x - self.mu) / self.sigma)**2 - log(self.sigma) -
+                0.5 * log(2 * pi))
 
 
 class TruncatedNormalPrior():
@@ -59,7 +62,7 @@ class TruncatedNormalPrior():
 
     def sample(self):
         """sample from truncated normal - very slow currently"""
-        return self.sample_gen.rvs(1)
+        return self.sample_gen.rvs(1, random_state=get_generator())
 
     def logpriorpdf(self, x):
         return log(self.sample_gen.pdf(x))
@@ -68,4 +71,106 @@ class TruncatedNormalPrior():
 class LogNormalPrior(NormalPrior):
 
     def sample(self):
-        return random.lognormal(self.mu, self.sigma, 1)
+        return lognormalrand(self.mu, self.sigma, 1)
+
+    def logpriorpdf(self, x):
+        if x <= 0:
+            return -np.inf
+        return (-0.5 * ((log(x) - self.mu) / self.sigma)**2 - log(x) -
+                log(self.sigma) - 0.5 * log(2 * pi))
+
+
+class PriorSet():
+    """ Priors of all dimensions with their parameters held in arrays.
+        Samples and log-densities are computed for whole arrays of points
+        in closed form. """
+    UNIFORM, NORMAL, LOGNORMAL, TRUNCATED_NORMAL = range(4)
+
+    def __init__(self, priors):
+        self.dimension = len(priors)
+        self.kind = np.empty(self.dimension, dtype=int)
+        self.mu = np.zeros(self.dimension)
+        self.sigma = np.ones(self.dimension)
+        self.lower_bound = np.empty(self.dimension)
+        self.upper_bound = np.empty(self.dimension)
+
+        for i, prior in enumerate(priors):
+            self.lower_bound[i] = prior.lower_bound
+            self.upper_bound[i] = prior.upper_bound
+            if isinstance(prior, UniformPrior):
+                self.kind[i] = self.UNIFORM
+                continue
+            self.mu[i], self.sigma[i] = prior.mu, prior.sigma
+            if isinstance(prior, LogNormalPrior):
+                self.kind[i] = self.LOGNORMAL
+            elif isinstance(prior, NormalPrior):
+                self.kind[i] = self.NORMAL
+            elif isinstance(prior, TruncatedNormalPrior):
+                self.kind[i] = self.TRUNCATED_NORMAL
+            else:
+                raise TypeError("Unknown prior type " + str(type(prior)))
+
+        self.uniform = self.kind == self.UNIFORM
+        self.normal = self.kind == self.NORMAL
+        self.lognormal = self.kind == self.LOGNORMAL
+        self.truncated = self.kind == self.TRUNCATED_NORMAL
+
+        # CDF of the standard normal at the bounds of the truncated normals
+        self.cdf_lower = special.ndtr((self.lower_bound - self.mu) /
+                                      self.sigma)
+        self.cdf_upper = special.ndtr((self.upper_bound - self.mu) /
+                                      self.sigma)
+
+        # Normalization constants of the log-densities
+        self.logconst = -np.log(self.sigma) - 0.5 * log(2 * pi)
+        self.logconst[self.truncated] -= np.log(
+            self.cdf_upper - self.cdf_lower)[self.truncated]
+        self.logconst[self.uniform] = -np.log(
+            self.upper_bound - self.lower_bound)[self.uniform]
+
+    def sample(self, n):
+        """ Draw n samples, returns array[n, dimension]. All dimensions are
+            obtained from one block of uniform numbers by inversion. """
+        u = uniformrand(0, 1, size=(n, self.dimension))
+        x = np.empty_like(u)
+
+        k = self.uniform
+        x[:, k] = self.lower_bound[k] + (
+                self.upper_bound[k] - self.lower_bound[k]) * u[:, k]
+        k = self.normal | self.lognormal
+        x[:, k] = self.mu[k] + self.sigma[k] * special.ndtri(u[:, k])
+        k = self.lognormal
+        x[:, k] = np.exp(x[:, k])
+        k = self.truncated
+        x[:, k] = self.mu[k] + self.sigma[k] * special.ndtri(
+            self.cdf_lower[k] + (self.cdf_upper[k] - self.cdf_lower[k]) *
+            u[:, k])
+        return x
+
+    def logpdf(self, x):
+        """ Log prior density of x[n, dimension], returns array[n]. A single
+            point x[dimension] returns a float. """
+        x = np.asarray(x, dtype=float)
+        single = x.ndim == 1
+        x = np.atleast_2d(x)
+
+        if self.uniform.all():
+            res = np.full(len(x), np.sum(self.logconst))
+        else:
+            k = self.lognormal
+            y = x.copy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                y[:, k] = np.log(x[:, k])
+                z = (y - self.mu) / self.sigma
+                logp = np.where(self.uniform, 0.0, -0.5 * z**2) + \
+                    self.logconst
+                logp[:, k] -= y[:, k]   # Jacobian of the log transform
+            logp[(x <= 0) & k] = -np.inf
+            res = np.sum(logp, axis=1)
+
+        bounded = self.uniform | self.truncated
+        outside = ((x < self.lower_bound) | (x > self.upper_bound)) & bounded
+        res[outside.any(axis=1)] = -np.inf
+        if single:
+            return res[0]
+        return res
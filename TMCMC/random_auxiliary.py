@@ -1,15 +1,119 @@
+""" Random numbers of TMCMC. All draws use the current generator of this
+    module, a numpy.random.Generator. The main generator and the
+    independent streams of the chains are derived from one root seed with
+    numpy.random.SeedSequence, so a run is reproducible for a given seed,
+    also when the chains run in worker processes. """
+
+import json
+
 import numpy as np
 
 
-def uniformrand(a, b):
+bit_generators = {'pcg64': np.random.PCG64, 'philox': np.random.Philox}
+
+_generator = np.random.Generator(np.random.PCG64())
+
+
+def make_generator(seed, bit_generator='pcg64'):
+    """Generator for seed, an int or a numpy.random.SeedSequence."""
+    return np.random.Generator(bit_generators[bit_generator](seed))
+
+
+def get_generator():
+    return _generator
+
+
+def set_generator(generator):
+    """Use generator for all following draws, returns the previous one."""
+    global _generator
+    previous, _generator = _generator, generator
+    return previous
+
+
+def seed_generator(root_seed, bit_generator='pcg64'):
+    """Seed the main generator from the root seed of the run."""
+    set_generator(make_generator(np.random.SeedSequence(root_seed),
+                                 bit_generator))
+
+
+def chain_seeds(root_seed, Gen, nchains):
+    """Seed sequences of the chains of generation Gen. The stream of a chain
+    depends only on the root seed, the generation and the chain index."""
+    return np.random.SeedSequence(root_seed, spawn_key=(Gen,)).spawn(nchains)
+
+
+def auxiliary_generator(root_seed, Gen, bit_generator='pcg64'):
+    """Generator for auxiliary draws of generation Gen, e.g. bootstrap
+    samples. It is independent of the main generator and of the chain
+    streams, so the sampling does not change if it is used."""
+    return make_generator(np.random.SeedSequence(root_seed,
+                                                 spawn_key=(Gen, 2**32)),
+                          bit_generator)
+
+
+def uniformrand(a, b, size=None):
     """Uniform distribution from a to b """
-    return np.random.uniform(low=a, high=b)
+    return _generator.uniform(low=a, high=b, size=size)
+
+
+def normalrand(mu, sigma, size=None):
+    """Normal distribution with mean mu and standard deviation sigma"""
+    return _generator.normal(loc=mu, scale=sigma, size=size)
+
+
+def lognormalrand(mu, sigma, size=None):
+    """Log-normal distribution, the log has mean mu and std sigma"""
+    return _generator.lognormal(mean=mu, sigma=sigma, size=size)
+
+
+def standard_normal(size=None):
+    return _generator.standard_normal(size=size)
 
 
 def multinomialrand(N, q):
     """Multinomial distribution formed by N trials from an underlying
         distribution p[k]"""
 
-    nn = np.random.multinomial(n=N, pvals=q)
+    nn = _generator.multinomial(n=N, pvals=q)
 
     return nn
+
+
+def generator_state():
+    """State of the current generator as a JSON string, e.g. for a
+    checkpoint. Integers, which exceed 64 bits for PCG64, and arrays are
+    written as strings, so reading the state never executes code."""
+    return json.dumps(encode_state(_generator.bit_generator.state))
+
+
+def set_generator_state(text):
+    """Continue from a state returned by generator_state."""
+    state = decode_state(json.loads(text))
+    name = state['bit_generator'].lower()
+    if name not in bit_generators:
+        raise ValueError("Bit generator " + name + " not recognised.")
+    generator = make_generator(None, name)
+    generator.bit_generator.state = state
+    set_generator(generator)
+
+
+def encode_state(value):
+    if isinstance(value, dict):
+        return {key: encode_state(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        return {'dtype': value.dtype.str,
+                'array': [str(item) for item in value.tolist()]}
+    if isinstance(value, (int, np.integer)):
+        return {'int': str(int(value))}
+    return value
+
+
+def decode_state(value):
+    if isinstance(value, dict):
+        if 'int' in value and len(value) == 1:
+            return int(value['int'])
+        if 'array' in value and len(value) == 2:
+            return np.array([int(item) for item in value['array']],
+                            dtype=np.dtype(value['dtype']))
+        return {key: decode_state(item) for key, item in value.items()}
+    return value
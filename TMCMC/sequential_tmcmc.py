@@ -11,24 +11,40 @@
 import argparse
 import sys
 import numpy as np
-from scipy import optimize, random, stats
+from scipy import optimize, stats
 import matplotlib.pyplot as plt
 import re
 import argparse
 from math import exp, log
 import configparser
+import copy
+import os
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor
 from importlib import import_module
+from jit import compile_loglikelihood
+from metrics import MetricsWriter, TimedLikelihood, timers
+from output import AsyncWriter, SyncWriter, make_sample_writer
 from priors import *
 from random_auxiliary import *
+from surrogate import RBFSurrogate
 
 
 class LogLikelihood:
-    """ """
+    """ Gaussian log-likelihood of the data given the model parameters,
+        d_i = f(t_i) + (alpha * |f(t_i)|^gamma + beta) * sigma * epsilon.
+
+        If the model function accepts an array of time points the whole
+        data set is evaluated in one NumPy pass, otherwise the model is
+        called once per time point. With jit the model and the loop over
+        the data are compiled with numba if it is available. """
     def __init__(self, model_function, data_file, parameters):
         self.sigma = parameters.error_prior.sigma
         self.alpha = parameters.alpha
         self.beta = parameters.beta
         self.gamma = parameters.gamma
+        # None = detect on first call, True/False = declared by the user
+        self.vectorized = parameters.vectorized
 
         # Load model function
         try:
@@ -37,6 +53,8 @@ class LogLikelihood:
         except:
             print("Model function could not been loaded.")
             raise
+        # Optional population-batched model f[N, M] = batch(thetas[N, d], t)
+        self.m_func_batch = getattr(self.model, 'model_function_batch', None)
 
         # Load data
         try:
@@ -44,8 +62,81 @@ class LogLikelihood:
         except:
             print("Error occurred during reading data file.")
             raise
+        self.t = np.ascontiguousarray(self.data[:, 0])
+        self.d = np.ascontiguousarray(self.data[:, 1])
+
+        self.kernel = None
+        self.kernel_batch = None
+        if parameters.jit:
+            self.compile(np.zeros(parameters.dimension))
+
+    def compile(self, theta):
+        """ Compile the log-likelihood kernels, warmed up at theta. """
+        kernels = compile_loglikelihood(self.m_func, self.t, self.d,
+                                        self.sigma, self.alpha, self.beta,
+                                        self.gamma, theta)
+        if kernels is not None:
+            self.kernel, self.kernel_batch, compile_time = kernels
+            print("JIT: model and log-likelihood compiled in " +
+                  "{0:.2f}".format(compile_time) + " s")
 
     def __call__(self, model_params):
+        if self.kernel is not None:
+            return self.kernel(np.asarray(model_params, dtype=float))
+        if self.vectorized is None:
+            self.vectorized = self.detect_vectorized(model_params)
+        if self.vectorized:
+            return self.loglik_vectorized(model_params)
+        return self.loglik_pointwise(model_params)
+
+    def detect_vectorized(self, model_params):
+        """ Check whether the model function maps the array of time points
+            to an array of model evaluations of the same length. """
+        try:
+            f = np.asarray(self.m_func(model_params, self.t), dtype=float)
+        except Exception:
+            return False
+        return f.shape == self.t.shape
+
+    def volatility(self, f):
+        """ Variance of the error term for model evaluations f. """
+        if self.gamma != 0 and self.alpha != 0:
+            return ((self.alpha * np.abs(f) ** self.gamma +
+                     self.beta) * self.sigma)**2
+        elif self.alpha != 0:
+            return ((self.alpha + self.beta) * self.sigma)**2
+        return (self.beta * self.sigma)**2
+
+    def loglik_vectorized(self, model_params):
+        f = np.asarray(self.m_func(model_params, self.t), dtype=float)
+        volatility = self.volatility(f)
+        res = - np.sum((self.d - f)**2 / (2*volatility))
+        if np.ndim(volatility) == 0:
+            res -= 0.5 * len(self.t) * log(2*np.pi*volatility)
+        else:
+            res -= 0.5 * np.sum(np.log(2*np.pi*volatility))
+        return res
+
+    def batch(self, thetas):
+        """ Log-likelihood of every row of thetas[N, d], returns array[N].
+            Uses model_function_batch if the model module provides it. """
+        thetas = np.atleast_2d(thetas)
+        if self.kernel_batch is not None:
+            return self.kernel_batch(np.ascontiguousarray(thetas,
+                                                          dtype=float))
+        if self.m_func_batch is None:
+            return np.array([self(theta) for theta in thetas], dtype=float)
+
+        f = np.asarray(self.m_func_batch(thetas, self.t), dtype=float)
+        volatility = self.volatility(f)
+        res = - np.sum((self.d - f)**2 / (2*volatility), axis=1)
+        if np.ndim(volatility) == 0:
+            res -= 0.5 * len(self.t) * log(2*np.pi*volatility)
+        else:
+            res -= 0.5 * np.sum(np.log(2*np.pi*volatility), axis=1)
+        return res
+
+    def loglik_pointwise(self, model_params):
         sum = 0
         volatility = (self.beta * self.sigma)**2
 
@@ -72,29 +163,66 @@ class Sort:
 
 
 class GenerationDB:
+    """ Samples of a generation, stored in contiguous arrays. Row k of
+        points holds the k-th sample, F[k] its log-likelihood and
+        logprior[k] its log-prior, so a sample that becomes a leader is not
+        evaluated again. For the leaders nsel[k] holds the length of the
+        chain started at row k. """
     def __init__(self):
-        self.point = None
-        self.entry = None
-
-        self.F = 0.0
-        self.nsel = -1
-        self.queue = -1
+        self.points = None
+        self.F = None
+        self.nsel = None
+        self.logprior = None
         self.entries = 0
 
-    def init(self, parameters):
-        self.entry = np.empty(parameters.PopSize + 1, dtype=object)
+    def init(self, parameters, size=None):
+        if size is None:
+            size = parameters.PopSize + 1
+        self.points = np.empty((size, parameters.dimension), dtype=float)
+        self.F = np.empty(size, dtype=float)
+        self.logprior = np.empty(size, dtype=float)
+        self.entries = 0
 
-    def update(self, point, F, parameters):
-        if self.entry is None:
+    def reserve(self, size):
+        """ Grow the arrays geometrically to hold at least size entries """
+        capacity = len(self.F)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        points = np.empty((capacity, self.points.shape[1]), dtype=float)
+        F = np.empty(capacity, dtype=float)
+        logprior = np.empty(capacity, dtype=float)
+        points[:self.entries] = self.points[:self.entries]
+        F[:self.entries] = self.F[:self.entries]
+        logprior[:self.entries] = self.logprior[:self.entries]
+        self.points, self.F, self.logprior = points, F, logprior
+        if self.nsel is not None:
+            nsel = np.zeros(capacity, dtype=int)
+            nsel[:self.entries] = self.nsel[:self.entries]
+            self.nsel = nsel
+
+    def update(self, point, F, logprior, parameters):
+        if self.points is None:
             self.init(parameters)
+        self.reserve(self.entries + 1)
 
         pos = self.entries
         self.entries += 1
-        self.entry[pos] = GenerationDB()
+        self.points[pos] = point
+        self.F[pos] = F
+        self.logprior[pos] = logprior
+
+    def extend(self, points, F, logprior, parameters):
+        """ Append several samples at once """
+        if self.points is None:
+            self.init(parameters)
+        self.reserve(self.entries + len(F))
 
-        if (self.entry[pos].point is None):
-            self.entry[pos].point = point.copy()
-            self.entry[pos].F = F
+        pos = self.entries
+        self.entries += len(F)
+        self.points[pos:self.entries] = points
+        self.F[pos:self.entries] = F
+        self.logprior[pos:self.entries] = logprior
 
     def print_size(self):
         print("=======")
@@ -102,6 +230,233 @@ class GenerationDB:
         print("=======")
 
 
+class Proposal:
+    """ Multivariate normal proposal centered at the chain's leader with
+        covariance bbeta * SS. The covariance only changes once per
+        generation, so it is factorized once and candidates are drawn as
+        leader + L z from a buffer of standard normal numbers.
+
+        Candidates outside the prior bounds are handled according to
+        bounds: 'reject' redraws one candidate at a time, 'batch' draws
+        batch_size candidates at once and keeps the first one inside the
+        bounds, 'reflect' folds the candidate back into the bounds.
+
+        Folding each coordinate separately is only symmetric for a diagonal
+        covariance, so for 'reflect' the chains add the Hastings correction
+        log_ratio to the acceptance ratio. 'reject' and 'batch' draw from
+        the Gaussian truncated to the bounds and are treated as symmetric:
+        the ratio of the truncation masses of leader and candidate is
+        ignored, so they are an approximation near the bounds. """
+    # standard deviations within which mirror images count in log_ratio,
+    # and the most combinations of them carried on per point
+    image_reach = 8
+    max_image_terms = 256
+
+    def __init__(self, SS, bbeta, lower_bound, upper_bound, bounds='reject',
+                 batch_size=16, buffer_size=1024):
+        self.cov = bbeta * SS
+        self.L = cholesky_factor(self.cov)
+        self.precision = np.linalg.pinv(self.cov)
+        self.scale = np.sqrt(np.diag(self.cov))
+        self.diagonal = not np.any(self.cov - np.diag(np.diag(self.cov)))
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.bounds = bounds
+        self.batch_size = batch_size
+        self.buffer_size = max(buffer_size, batch_size)
+        self.buffer = None
+
+        # Number of candidates returned, of normal vectors drawn and of
+        # candidates accepted by the chains
+        self.nproposals = 0
+        self.ndraws = 0
+        self.naccepted = 0
+
+    def reset(self, buffer_size=None):
+        """ Discard the buffered normal numbers, e.g. after reseeding. The
+            next blocks hold buffer_size vectors, e.g. the number of steps
+            of the chain that follows. """
+        if buffer_size is not None:
+            self.buffer_size = max(buffer_size, self.batch_size)
+        self.buffer = None
+
+    def counts(self):
+        return self.ndraws, self.nproposals, self.naccepted
+
+    def add_counts(self, ndraws, nproposals, naccepted):
+        """ Add the counts of a copy of the proposal, e.g. in a worker """
+        self.ndraws += ndraws
+        self.nproposals += nproposals
+        self.naccepted += naccepted
+
+    def standard_normal(self, n=1):
+        """ Next n standard normal vectors of the buffer, array[n, dim] """
+        if self.buffer is None or self.pos + n > len(self.buffer):
+            self.buffer = standard_normal((self.buffer_size, len(self.L)))
+            self.pos = 0
+        z = self.buffer[self.pos:self.pos+n]
+        self.pos += n
+        self.ndraws += n
+        return z
+
+    def inside(self, x):
+        return np.all((x >= self.lower_bound) & (x <= self.upper_bound),
+                      axis=-1)
+
+    def reflect(self, x):
+        width = self.upper_bound - self.lower_bound
+        y = np.mod(x - self.lower_bound, 2 * width)
+        return self.lower_bound + np.where(y > width, 2 * width - y, y)
+
+    def image_shifts(self, y):
+        """ Shifts y' - y[:, i] of the points y' other than y[:, i] that
+            reflect folds onto y[:, i], array[N, d, M] """
+        width = self.upper_bound - self.lower_bound
+        n = int(np.max(self.image_reach * self.scale / (2 * width))) + 1
+        k = 2 * np.arange(-n, n + 1)
+        # lower_bound + k width -+ (y - lower_bound), k = 0 with + is y
+        minus = 2 * (self.lower_bound - y)[..., None] + k * width[:, None]
+        plus = np.broadcast_to(k[k != 0] * width[:, None],
+                               minus.shape[:2] + (2 * n,))
+        return np.concatenate((minus, plus), axis=2)
+
+    def log_image_sum(self, x, y):
+        """ Log of the Gaussian of reflect proposing y from x summed over
+            the points that fold onto y, relative to the term of y itself.
+
+            Per row and coordinate only the images within image_reach
+            standard deviations of x count, so rows far from the bounds cost
+            nothing. The coordinates with images are added one at a time,
+            closest first, and per row only the max_image_terms heaviest
+            combinations of images are carried on. The sum is exact as long
+            as no combination has to be dropped. """
+        shifts = self.image_shifts(y)
+        distance = np.abs((y - x)[..., None] + shifts) / self.scale[:, None]
+        near = distance < self.image_reach
+        rows = np.flatnonzero(near.any(axis=(1, 2)))
+        logsum = np.zeros(len(y))
+        if len(rows) == 0:
+            return logsum
+        shifts, near = shifts[rows], near[rows]
+        closest = np.where(near, distance[rows], np.inf).min(axis=2)
+        coordinates = np.argsort(closest, axis=1)[
+            :, :np.max(np.count_nonzero(near.any(axis=2), axis=1))]
+
+        # log weight of moving a single coordinate of y to an image, the
+        # images of each coordinate after y itself
+        g = np.dot(y[rows] - x[rows], self.precision)
+        w = -0.5 * shifts * (2 * g[..., None] +
+                             shifts * np.diag(self.precision)[:, None])
+        w[~near] = -np.inf
+        shifts[~near] = 0
+        order = np.argsort(-w, axis=2)[..., :np.max(near.sum(axis=2))]
+        w = np.take_along_axis(w, order, axis=2)
+        shifts = np.take_along_axis(shifts, order, axis=2)
+        w = np.concatenate((np.zeros(w.shape[:2] + (1,)), w), axis=2)
+        shifts = np.concatenate((np.zeros(w.shape[:2] + (1,)), shifts),
+                                axis=2)
+
+        # precision matrix in the order in which the coordinates are added
+        precision = self.precision[coordinates[..., None],
+                                   coordinates[:, None, :]]
+        nterms, nimages = self.max_image_terms, w.shape[2]
+        chunk = max(1, 2**22 // (nterms * nimages * coordinates.shape[1]))
+        for start in range(0, len(rows), chunk):
+            block = np.arange(start, min(start + chunk, len(rows)))
+            # log weights of the combinations so far, and for their cross
+            # terms the precision matrix times their shifts in the
+            # coordinates still to add
+            logw = np.zeros((len(block), 1))
+            coupling = np.zeros((len(block), 1, coordinates.shape[1]))
+            for t, i in enumerate(coordinates[block].T):
+                wi, si = w[block, i], shifts[block, i]
+                terms = (logw[..., None] + wi[:, None] -
+                         si[:, None] * coupling[..., :1]).reshape(
+                             len(block), -1)
+                if terms.shape[1] > nterms:
+                    keep = np.argpartition(-terms, nterms - 1,
+                                           axis=1)[:, :nterms]
+                else:
+                    keep = np.broadcast_to(np.arange(terms.shape[1]),
+                                           terms.shape)
+                logw = np.take_along_axis(terms, keep, axis=1)
+                parent, image = np.divmod(keep, nimages)
+                coupling = np.take_along_axis(
+                    coupling[..., 1:], parent[..., None], axis=1) + \
+                    np.take_along_axis(si, image, axis=1)[..., None] * \
+                    precision[block, t, None, t+1:]
+            logsum[rows[block]] = np.logaddexp.reduce(logw, axis=1)
+        return logsum
+
+    def log_ratio(self, leader, candidate):
+        """ Hastings correction log q(candidate -> leader) -
+            log q(leader -> candidate) for points[d] or arrays[N, d]. Zero
+            unless bounds is 'reflect' and the covariance is not diagonal.
+            """
+        x = np.atleast_2d(leader)
+        y = np.atleast_2d(candidate)
+        ratio = np.zeros(len(y))
+        if self.bounds == 'reflect' and not self.diagonal:
+            ratio = self.log_image_sum(y, x) - self.log_image_sum(x, y)
+        if np.ndim(candidate) == 1:
+            return ratio[0]
+        return ratio
+
+    def __call__(self, leader):
+        start = timer()
+        candidate = self.propose(leader)
+        timers.add('proposal', timer() - start)
+        return candidate
+
+    def propose(self, leader):
+        self.nproposals += 1
+        if self.bounds == 'reflect':
+            return self.reflect(leader + self.L @ self.standard_normal()[0])
+
+        n = self.batch_size if self.bounds == 'batch' else 1
+        while True:
+            candidates = leader + self.standard_normal(n) @ self.L.T
+            valid = np.flatnonzero(self.inside(candidates))
+            if len(valid) > 0:
+                # count only the draws up to the accepted one
+                self.ndraws -= n - valid[0] - 1
+                return candidates[valid[0]]
+
+    def propose_all(self, leaders):
+        """ One candidate inside the bounds for every row of leaders """
+        start = timer()
+        candidates = self.propose_batch(leaders)
+        timers.add('proposal', timer() - start)
+        return candidates
+
+    def propose_batch(self, leaders):
+        n = len(leaders)
+        self.nproposals += n
+        self.ndraws += n
+        candidates = leaders + standard_normal(leaders.shape) @ self.L.T
+        if self.bounds == 'reflect':
+            return self.reflect(candidates)
+
+        redraw = np.flatnonzero(~self.inside(candidates))
+        while len(redraw) > 0:
+            self.ndraws += len(redraw)
+            candidates[redraw] = leaders[redraw] + standard_normal(
+                                        (len(redraw), len(self.L))) @ self.L.T
+            redraw = redraw[~self.inside(candidates[redraw])]
+        return candidates
+
+
+def cholesky_factor(cov):
+    """ Lower triangular L with L L^T = cov. Falls back to the symmetric
+        square root of the eigendecomposition if cov is only positive
+        semi-definite. """
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        w, V = np.linalg.eigh(cov)
+        return V * np.sqrt(np.clip(w, 0, None))
+
+
 class OptimOptions:
     def __init__(self):
         self.MaxIter = None
@@ -115,23 +470,120 @@ class RunInfo:
         return
 
     def init_runinfo(self, parameters):
-        self.CoefVar = np.zeros(parameters.MaxStages + 1, dtype=np.float)
-        self.p = np.zeros(parameters.MaxStages + 1, dtype=np.float)
-        self.currentuniques = np.zeros(parameters.MaxStages, dtype=np.float)
-        self.logselection = np.zeros(parameters.MaxStages, dtype=np.float)
-        self.acceptance = np.zeros(parameters.MaxStages, dtype=np.float)
+        self.CoefVar = np.zeros(parameters.MaxStages + 1, dtype=float)
+        self.p = np.zeros(parameters.MaxStages + 1, dtype=float)
+        self.currentuniques = np.zeros(parameters.MaxStages, dtype=float)
+        self.logselection = np.zeros(parameters.MaxStages, dtype=float)
+        self.acceptance = np.zeros(parameters.MaxStages, dtype=float)
+        # effective sample size of the importance weights
+        self.ess = np.zeros(parameters.MaxStages, dtype=float)
+        # proposal scale of every generation
+        self.bbeta = np.full(parameters.MaxStages + 1, parameters.bbeta,
+                             dtype=float)
+        self.proposal_draws = np.zeros(parameters.MaxStages, dtype=float)
+        self.surrogate_screened = np.zeros(parameters.MaxStages,
+                                           dtype=float)
+        self.surrogate_rejected = np.zeros(parameters.MaxStages,
+                                           dtype=float)
+        # bootstrap replicates of logselection for the evidence error
+        self.logselection_boot = np.zeros((parameters.MaxStages,
+                                           parameters.evidence_bootstrap),
+                                          dtype=float)
         self.SS = np.zeros((parameters.dimension, parameters.dimension),
-                           dtype=np.float)
+                           dtype=float)
         self.meantheta = np.zeros((parameters.MaxStages, parameters.dimension),
-                                  dtype=np.float)
+                                  dtype=float)
         self.Gen = 0
         self.CoefVar[0] = 10
-
-    def save_runinfo(self):
-        return None
-
-    def load_runinfo(self):
-        return None
+        self.seed = None    # root seed of the random streams
+        self.surrogate = None
+        if parameters.surrogate:
+            self.surrogate = RBFSurrogate(parameters.surrogate_max_points)
+
+    # Arrays of the run state written to and read from a checkpoint
+    checkpoint_arrays = ('CoefVar', 'p', 'currentuniques', 'logselection',
+                         'acceptance', 'ess', 'bbeta', 'proposal_draws',
+                         'surrogate_screened',
+                         'surrogate_rejected', 'logselection_boot', 'SS',
+                         'meantheta')
+
+    def save_runinfo(self, filename, parameters, leaders, nchains,
+                     curgen_db, nsamples, chain_seed):
+        """ Write a checkpoint from which the run continues at generation
+            Gen: run statistics, leaders of the generation, the nsamples
+            samples of the previous generation and the state of the random
+            generator. """
+        write_checkpoint(filename, self.checkpoint_state(
+            parameters, leaders, nchains, curgen_db, nsamples, chain_seed))
+
+    def checkpoint_state(self, parameters, leaders, nchains, curgen_db,
+                         nsamples, chain_seed):
+        """ Copy of everything save_runinfo writes, so the checkpoint can be
+            written while the run continues. """
+        state = {name: getattr(self, name).copy()
+                 for name in self.checkpoint_arrays
+                 if name != 'logselection_boot'}
+        # only the bootstrap samples of the finished generations
+        state['logselection_boot'] = \
+            self.logselection_boot[:self.Gen+1].copy()
+        state.update(
+            Gen=self.Gen, Num=parameters.Num.copy(),
+            leaders_points=leaders.points[:nchains].copy(),
+            leaders_F=leaders.F[:nchains].copy(),
+            leaders_nsel=leaders.nsel[:nchains].copy(),
+            samples_points=curgen_db.points[:nsamples].copy(),
+            samples_F=curgen_db.F[:nsamples].copy(),
+            chain_seed=str(chain_seed),
+            rng_state=generator_state())
+        surrogate = self.surrogate
+        if surrogate is not None and surrogate.points is not None:
+            state.update(surrogate_points=surrogate.points.copy(),
+                         surrogate_values=surrogate.values.copy())
+            if surrogate.ready():
+                state.update(surrogate_fit_points=surrogate.fit_points,
+                             surrogate_fit_values=surrogate.fit_values)
+        return state
+
+    def load_runinfo(self, filename, parameters, leaders):
+        """ Restore the state written by save_runinfo. Returns the number of
+            chains of the generation and the root seed of the chains. """
+        with np.load(filename) as checkpoint:
+            self.Gen = int(checkpoint['Gen'])
+            for name in self.checkpoint_arrays:
+                array = getattr(self, name)
+                n = min(len(array), len(checkpoint[name]))
+                array[:n] = checkpoint[name][:n]
+            n = min(len(parameters.Num), len(checkpoint['Num']))
+            parameters.Num[:n] = checkpoint['Num'][:n]
+
+            nchains = len(checkpoint['leaders_F'])
+            leaders.entries = 0
+            leaders.extend(checkpoint['leaders_points'],
+                           checkpoint['leaders_F'],
+                           logpriorpdf(checkpoint['leaders_points'],
+                                       n=parameters.dimension,
+                                       parameters=parameters), parameters)
+            leaders.nsel[:nchains] = checkpoint['leaders_nsel']
+            chain_seed = int(str(checkpoint['chain_seed']))
+
+            set_generator_state(str(checkpoint['rng_state']))
+            if self.surrogate is not None and \
+                    'surrogate_points' in checkpoint:
+                self.surrogate.points = checkpoint['surrogate_points']
+                self.surrogate.values = checkpoint['surrogate_values']
+                if 'surrogate_fit_points' in checkpoint:
+                    self.surrogate.fit(checkpoint['surrogate_fit_points'],
+                                       checkpoint['surrogate_fit_values'])
+        self.proposal = make_proposal(self, parameters, self.bbeta[self.Gen])
+        return nchains, chain_seed
+
+
+def write_checkpoint(filename, state):
+    """Write the checkpoint state to filename."""
+    tmp_filename = filename + '.tmp.npz'
+    np.savez(tmp_filename, **state)
+    # Replace the previous checkpoint only once the new one is complete
+    os.replace(tmp_filename, filename)
 
 
 class Parameters:
@@ -199,9 +651,99 @@ class Parameters:
                                             'max_stages'])
             self.seed = int(config_tmcmc['SIMULATION SETTINGS'][
                                             'seed'])
+            # OPTIONAL: checkpoint written after every generation, the
+            #           run can be continued from it with --resume
+            self.checkpoint_file = config_tmcmc['SIMULATION SETTINGS'].get(
+                        'checkpoint_file', 'tmcmc_checkpoint.npz').strip()
+            # OPTIONAL: format of the generation dumps, npy, hdf5 or text
+            self.sample_format = config_tmcmc.get('OUTPUT', 'format',
+                                                  fallback='npy').strip()
+            self.text_export = config_tmcmc.getboolean('OUTPUT',
+                                                       'text_export',
+                                                       fallback=False)
+            self.hdf5_file = config_tmcmc.get('OUTPUT', 'hdf5_file',
+                                              fallback='tmcmc_samples.h5')
+            # OPTIONAL: write output in a background thread
+            self.async_output = config_tmcmc.getboolean('OUTPUT', 'async',
+                                                        fallback=True)
+            self.output_queue_size = config_tmcmc.getint('OUTPUT',
+                                                         'queue_size',
+                                                         fallback=2)
+            # OPTIONAL: log-evidence file written with the final samples
+            #           and number of bootstrap samples of its error
+            self.evidence_file = config_tmcmc.get(
+                'OUTPUT', 'evidence_file', fallback='log_evidence.txt').strip()
+            self.evidence_bootstrap = config_tmcmc.getint(
+                'OUTPUT', 'evidence_bootstrap', fallback=200)
+            # OPTIONAL: metrics of every generation as jsonl or csv, an
+            #           empty metrics_file disables them
+            self.metrics_file = config_tmcmc.get(
+                'OUTPUT', 'metrics_file',
+                fallback='tmcmc_metrics.jsonl').strip()
+            self.metrics_format = config_tmcmc.get(
+                'OUTPUT', 'metrics_format', fallback='jsonl').strip().lower()
+            # OPTIONAL: 0 = final result only, 1 = one line per generation,
+            #           2 = statistics of every generation, 3 = everything
+            self.options.display = config_tmcmc.getint('OUTPUT', 'verbosity',
+                                                       fallback=1)
+            # OPTIONAL: adapt bbeta toward a target acceptance rate and
+            #           split chains longer than max_chain_length, 0 = off
+            self.adapt_bbeta = config_tmcmc['SIMULATION SETTINGS'].getboolean(
+                                            'adapt_bbeta', fallback=False)
+            self.target_acceptance = config_tmcmc[
+                'SIMULATION SETTINGS'].getfloat('target_acceptance',
+                                                fallback=0.25)
+            self.max_chain_length = config_tmcmc[
+                'SIMULATION SETTINGS'].getint('max_chain_length', fallback=0)
+            # OPTIONAL: bit generator of the random streams, pcg64 or philox
+            self.rng = config_tmcmc['SIMULATION SETTINGS'].get(
+                                            'rng', 'pcg64').strip().lower()
+            # OPTIONAL: worker processes for the leader chains
+            self.workers = config_tmcmc.getint('PARALLEL', 'workers',
+                                               fallback=1)
+            self.chunk_size = config_tmcmc.getint('PARALLEL', 'chunk_size',
+                                                  fallback=16)
+            # OPTIONAL: handling of candidates outside the prior bounds,
+            #           reject, batch or reflect
+            self.proposal_bounds = config_tmcmc['SIMULATION SETTINGS'].get(
+                                'proposal_bounds', 'reject').strip().lower()
+            # OPTIONAL: chain = one leader after the other,
+            #           lockstep = all chains advance together,
+            #           vectorized = short chains of the whole population
+            #           as array operations
+            self.engine = config_tmcmc['SIMULATION SETTINGS'].get(
+                                            'engine', 'chain').strip().lower()
+            # OPTIONAL: screen candidates with an emulator of the
+            #           log-likelihood before running the model
+            self.surrogate = config_tmcmc.getboolean('SURROGATE', 'enabled',
+                                                     fallback=False)
+            self.surrogate_start = config_tmcmc.getint(
+                            'SURROGATE', 'start_generation', fallback=1)
+            self.surrogate_refit = config_tmcmc.getint(
+                            'SURROGATE', 'refit_interval', fallback=1)
+            self.surrogate_max_points = config_tmcmc.getint(
+                            'SURROGATE', 'max_points', fallback=500)
         except:
             print("Error occurred while reading configuration parameters. ")
             raise
+        assert self.engine in ('chain', 'lockstep', 'vectorized'), \
+            "Engine " + self.engine + " not recognised."
+        assert self.proposal_bounds in ('reject', 'batch', 'reflect'), \
+            "Proposal bounds " + self.proposal_bounds + " not recognised."
+        assert self.metrics_format in ('jsonl', 'csv'), \
+            "Metrics format " + self.metrics_format + " not recognised."
+        assert self.rng in bit_generators, \
+            "Random generator " + self.rng + " not recognised."
+        assert self.surrogate_refit > 0, "refit_interval must be positive."
+
+        # OPTIONAL: compile the model and the likelihood with numba
+        self.jit = config_common['MODEL'].getboolean('jit', fallback=False)
+        # OPTIONAL: auto = detect whether the model accepts a time array
+        vectorized = config_common['MODEL'].get('vectorized', 'auto')
+        if vectorized.strip().lower() == 'auto':
+            self.vectorized = None
+        else:
+            self.vectorized = config_common['MODEL'].getboolean('vectorized')
         re_expr = re.compile(
                 "\s[+-]?(?=\d*)(?=\.?\d)\d*\.?\d*(?:[eE][+-]?\d+)?")
         self.priors = np.full(self.dimension+1, None)
@@ -240,6 +782,7 @@ class Parameters:
                                    " not recognised.")
         self.error_prior = self.priors[self.dimension]
         self.priors = np.array(self.priors[0:self.dimension])
+        self.prior_set = PriorSet(self.priors)
         self.Num = np.full(self.MaxStages, self.PopSize)
         #self.print_data()
 
@@ -252,48 +795,67 @@ def init_chaintask(in_tparam, parameters, curgen_db, loglikelihood):
     """ Evaluate function values F(c) = Posterior(c) """
     point = in_tparam.copy()
     fpoint = loglikelihood(point)
-    curgen_db.update(point, fpoint, parameters)
+    curgen_db.update(point, fpoint, logpriorpdf(point, n=parameters.dimension,
+                                                parameters=parameters),
+                     parameters)
+
+
+def init_chaintask_batch(in_tparams, parameters, curgen_db, loglikelihood):
+    """ Evaluate F(c) = Posterior(c) for all starting points c at once """
+    points = np.array(in_tparams, dtype=float)
+    curgen_db.extend(points, loglikelihood.batch(points),
+                     logpriorpdf(points, n=parameters.dimension,
+                                 parameters=parameters), parameters)
 
 
 def prepare_newgen(nchains, leaders, curgen_db, parameters, runinfo):
     """ DOCUMENTATION """
+    start = timer()
+    prior_time = timers.times['prior']
 
     n = curgen_db.entries
-    fj = np.empty(n, dtype=np.float)
-    sel = np.zeros(n, dtype=np.int)
+    fj = curgen_db.F[:n].copy()
+    sel = np.zeros(n, dtype=int)
+    # the samples of the first generation are drawn independently
+    if runinfo.Gen == 0:
+        blocks = np.arange(n)
+    else:
+        blocks = chain_blocks(leaders, nchains)
 
-    for i in range(n):
-        fj[i] = curgen_db.entry[i].F
     calculate_statistics(fj, parameters=parameters, runinfo=runinfo,
-                         curgen_db=curgen_db, sel=sel)
-    newchains = 0
-    for i in range(n):
-        if sel[i] != 0:
-            newchains += 1
-
-    ldi = 0       # leader index
-    for i in range(n):
-        # Check if selected by normalized plausability weights
-        if sel[i] != 0:
-            idx = i
-            for p in range(parameters.dimension):
-                leaders[ldi].point[p] = curgen_db.entry[idx].point[p]
-            leaders[ldi].F = curgen_db.entry[idx].F
-            leaders[ldi].nsel = sel[i]
-            ldi += 1
+                         curgen_db=curgen_db, sel=sel, blocks=blocks)
 
-    curgen_db.entries = 0
+    # Leaders are the samples selected by normalized plausability weights
+    idx = np.flatnonzero(sel)
+    newchains = len(idx)
+    leaders.entries = 0
+    leaders.extend(curgen_db.points[idx], curgen_db.F[idx],
+                   curgen_db.logprior[idx], parameters)
+    leaders.nsel[:newchains] = sel[idx]
 
-    print("calculate statistics: newchains = " + str(newchains))
+    if parameters.max_chain_length > 0:
+        newchains = split_chains(leaders, newchains,
+                                 parameters.max_chain_length, parameters)
 
-    return newchains
+    if runinfo.surrogate is not None:
+        update_surrogate(runinfo, parameters, curgen_db)
+
+    curgen_db.entries = 0
 
+    if parameters.options.display > 1:
+        print("calculate statistics: newchains = " + str(newchains))
 
+    # the log-prior of the leaders is counted as prior time
+    timers.add('statistics', timer() - start -
+               (timers.times['prior'] - prior_time))
+    return newchains
 
 
-def calculate_statistics(flc, parameters, runinfo, curgen_db, sel):
+def calculate_statistics(flc, parameters, runinfo, curgen_db, sel,
+                         blocks):
     """ Calculate annealing constang p_{j+1} s.t. COV of
-        {f(D|M,theta)}^{p_{j+1} - p_j} is within tolCOV. """
+        {f(D|M,theta)}^{p_{j+1} - p_j} is within tolCOV. blocks holds the
+        chain of every sample for the bootstrap of logselection. """
     display = parameters.options.display
     tolCOV = parameters.tolCOV
     CoefVar = runinfo.CoefVar
@@ -305,30 +867,11 @@ def calculate_statistics(flc, parameters, runinfo, curgen_db, sel):
     Gen = runinfo.Gen
     maxIter = parameters.options.MaxIter
     n = curgen_db.entries
-    fmin, xmin, conv = 0, 0, 0
-
-# Estimate p_{j+1} such that COV of objlog is lower than a prescribed threshold
-    if conv == 0:
-        method = 'Nelder-Mead'
-        options = {
-            'disp': True,
-            'maxiter': maxIter,
-            'xatol': tol,
-            'return_all': True,
-            'fatol': tol}
-        res = optimize.minimize(
-            obj_log_p, p[Gen], method=method, args=(
-                flc, p[Gen], tolCOV), options=options)
-        xmin = res.x
-        fmin = res.fun
-        conv = res.success
-        print(
-            "fminsearch: conv = " +
-            str(conv) +
-            " xmin = " +
-            str(xmin) +
-            " fmin = " +
-            str(fmin))
+
+    # Estimate p_{j+1} such that COV of objlog is lower than a prescribed
+    # threshold
+    xmin, fmin, conv = solve_annealing_exponent(flc, p[Gen], tolCOV, tol,
+                                                maxIter, display)
 
     j = Gen + 1
 
@@ -343,94 +886,244 @@ def calculate_statistics(flc, parameters, runinfo, curgen_db, sel):
         p[j] = 1
         Num[j] = parameters.PopSize
 
-    flcp = np.empty(n, dtype=np.float)
-    for i in range(n):
-        flcp[i] = flc[i] * (p[j] - p[j - 1])
-
+    # Importance weights w_i = f_i^(p_{j+1} - p_j), kept in log-space and
+    # shifted by their maximum before exponentiation
+    flcp = flc * (p[j] - p[j - 1])
     fjmax = np.max(flcp)
-    weight = np.zeros(n, dtype=np.float)
-    for i in range(n):
-        weight[i] = np.exp(flcp[i] - fjmax)
-
+    weight = np.exp(flcp - fjmax)
     sum_weight = np.sum(weight)
 
     # calculate normalized weights and save to q
-    q = np.empty(n, dtype=np.float)
-    for i in range(n):
-        q[i] = weight[i] / sum_weight
+    q = weight / sum_weight
+    runinfo.ess[Gen] = 1 / np.sum(q**2)
 
     # if (display):
     #     print("runinfo_q - normalized weights" + str(q))
 
     runinfo.logselection[Gen] = np.log(sum_weight) + fjmax - np.log(n)
-    if (display):
+    if parameters.evidence_bootstrap > 0:
+        runinfo.logselection_boot[Gen] = bootstrap_logselection(
+            weight, blocks, fjmax, parameters.evidence_bootstrap,
+            auxiliary_generator(runinfo.seed, Gen, parameters.rng))
+    if display > 1:
         print("logselection \n" + str(logselection[0:Gen+1]))
         print("\n")
         print("\n")
     CoefVar[Gen] = np.std(q) / np.mean(q)
 
-    if(display):
+    if display > 1:
         print("CoefVar  \n" + str(CoefVar[0:Gen+1]))
         print("\n")
         print("\n")
 
-    N = 1
+    # Draw PopSize selections from K with probabilites q = normalized
+    # weights, selected samples are distributed as f_{j+1}. n is smaller
+    # than PopSize if chains were split, see split_chains
+    sel[:] = multinomialrand(parameters.PopSize, q)
 
-    samples = n
+    if display > 2:
+        print("SEL = " + str(sel))
 
-    nselections = samples
+    # Weighted mean and covariance of the samples
+    points = curgen_db.points[:n]
+    meanv = q @ points
+    runinfo.meantheta[Gen] = meanv
+    deviation = points - meanv
+    SS = (deviation * q[:, np.newaxis]).T @ deviation
+    runinfo.SS[:] = 0.5 * (SS + SS.T)
 
-    for i in range(samples):
-        sel[i] = 0
+    if display > 1:
+        print("ESS = " + str(runinfo.ess[Gen]))
+        print("runinfo.SS = \n" + str(runinfo.SS))
 
+    if parameters.adapt_bbeta and Gen > 0:
+        runinfo.bbeta[j] = adapt_bbeta(runinfo.bbeta[Gen],
+                                       runinfo.acceptance[Gen],
+                                       parameters.target_acceptance)
+        if display > 1:
+            print("bbeta = " + str(runinfo.bbeta[j]))
+    else:
+        runinfo.bbeta[j] = runinfo.bbeta[Gen]
+    runinfo.proposal = make_proposal(runinfo, parameters, runinfo.bbeta[j])
 
-    # Draw nselections from K with probabilites q = normalized weights
-    # selected samples are distributed as f_{j+1}
-    nn = multinomialrand(nselections, q)
-    for i in range(n):
-        sel[i] += nn[i]
 
-    if (display):
-        print("SEL = " + str(sel))
+def adapt_bbeta(bbeta, acceptance, target):
+    """Scale of the proposal covariance for the next generation. The
+    standard deviation of the proposal is multiplied by
+    exp(acceptance - target), so it grows if too many candidates are
+    accepted and shrinks if too few are."""
+    return bbeta * np.exp(2 * (acceptance - target))
 
-    mean_of_theta = np.zeros(parameters.dimension, dtype=np.float)
-    for i in range(parameters.dimension):
-        for j in range(n):
-            mean_of_theta[i] += curgen_db.entry[j].point[i] * q[j]
 
-        runinfo.meantheta[Gen][i] = mean_of_theta[i]
-    meanv = np.empty(parameters.dimension)
-    for i in range(parameters.dimension):
-        meanv[i] = mean_of_theta[i]
+def split_chains(leaders, nchains, max_length, parameters):
+    """Split the chains longer than max_length into chains of about equal
+    length started from the same leader. The split chains share the
+    nsel + burn_in steps of the original chain, so every extra chain pays
+    its burn-in with burn_in samples and the model evaluations stay at
+    N + nchains * burn_in. Every split chain keeps at least one sample.
+    Returns the new number of chains."""
+    burn_in = parameters.burn_in
+    nsel = leaders.nsel[:nchains]
+    budget = nsel + burn_in
+    nsplit = np.minimum(-(-budget // (max_length + burn_in)),
+                        budget // (burn_in + 1))
+    if np.all(nsplit <= 1):
+        return nchains
+    nsplit = np.maximum(nsplit, 1)
+    idx = np.repeat(np.arange(nchains), nsplit)
+    part = np.arange(len(idx)) - (np.cumsum(nsplit) - nsplit)[idx]
+    nsteps = budget[idx] // nsplit[idx] + (part < budget[idx] % nsplit[idx])
+    nsel = nsteps - burn_in
+    points = leaders.points[idx]
+    F = leaders.F[idx]
+    logprior = leaders.logprior[idx]
+
+    leaders.entries = 0
+    leaders.extend(points, F, logprior, parameters)
+    leaders.nsel[:len(idx)] = nsel
+    return len(idx)
+
+
+def bootstrap_logselection(weight, blocks, fjmax, nboot, generator):
+    """Log of the mean importance weight for nboot bootstrap resamples of
+    the weights exp(log w - fjmax). The samples of a chain are correlated,
+    so whole chains are resampled: blocks[i] is the chain of sample i, see
+    chain_blocks. The resamples are drawn in chunks of about 2^20
+    indices."""
+    sums = np.bincount(blocks, weights=weight)
+    counts = np.bincount(blocks)
+    nblocks = len(counts)
+    logmean = np.empty(nboot, dtype=float)
+    chunk = max(1, 2**20 // nblocks)
+    for start in range(0, nboot, chunk):
+        idx = generator.integers(0, nblocks,
+                                 size=(min(chunk, nboot - start), nblocks))
+        logmean[start:start+len(idx)] = np.log(
+            np.sum(sums[idx], axis=1) / np.sum(counts[idx], axis=1))
+    return logmean + fjmax
+
+
+def chain_blocks(leaders, nchains):
+    """Chain of every sample of a generation, the samples are stored chain
+    after chain. The chains split from one leader start from the same
+    point and count as one chain, see split_chains."""
+    points = leaders.points[:nchains]
+    first = np.ones(nchains, dtype=bool)
+    first[1:] = np.any(points[1:] != points[:-1], axis=1)
+    return np.repeat(np.cumsum(first) - 1, leaders.nsel[:nchains])
+
+
+def log_evidence(runinfo):
+    """Log-evidence of the model, the sum of logselection over the
+    generations, and its within-stage bootstrap standard error. The stages
+    are resampled independently, so the replicates of the sum are the sums
+    of the replicates. The error only covers the resampling of the chains
+    within every stage; the populations of successive stages descend from
+    each other, so the spread over independent runs is larger and the
+    value is a lower bound."""
+    Gen = runinfo.Gen
+    logev = np.sum(runinfo.logselection[:Gen+1])
+    boot = runinfo.logselection_boot[:Gen+1]
+    se = np.std(np.sum(boot, axis=0)) if boot.shape[1] > 1 else np.nan
+    return logev, se
 
-    for i in range(parameters.dimension):
-        for j in range(parameters.dimension):
-            s = 0
-            for k in range(n):
-                s += q[k] * (curgen_db.entry[k].point[i] - meanv[i]) * \
-                    (curgen_db.entry[k].point[j] - meanv[j])
-            runinfo.SS[i][j] = s
-            runinfo.SS[j][i] = s
-
-    if (display):
-        print("runinfo.SS = \n" + str(runinfo.SS))
+
+def write_evidence(filename, logev, se, p, logselection, logselection_boot):
+    """Write the log-evidence and its breakdown per generation."""
+    if logselection_boot.shape[1] > 1:
+        stage_se = np.std(logselection_boot, axis=1)
+    else:
+        stage_se = np.full(len(logselection), np.nan)
+    header = ("log_evidence = " + repr(float(logev)) + "\n" +
+              "within_stage_se = " + repr(float(se)) + "\n" +
+              "Gen p logselection within_stage_se")
+    np.savetxt(filename, np.column_stack((np.arange(len(logselection)), p,
+                                          logselection, stage_se)),
+               fmt=["%d", "%.17g", "%.17g", "%.17g"], header=header)
+
+
+def report_evidence(runinfo, parameters, output):
+    """Print the log-evidence and write it next to the final samples."""
+    logev, se = log_evidence(runinfo)
+    runinfo.logevidence = logev
+    runinfo.logevidence_within_se = se
+    print("log-evidence = " + str(logev) +
+          " within-stage standard error (lower bound) = " + str(se))
+    if parameters.evidence_file:
+        Gen = runinfo.Gen
+        output.submit(write_evidence, parameters.evidence_file, logev, se,
+                      runinfo.p[:Gen+1].copy(),
+                      runinfo.logselection[:Gen+1].copy(),
+                      runinfo.logselection_boot[:Gen+1].copy())
+
+
+def make_proposal(runinfo, parameters, bbeta):
+    """Proposal of the chains of the next generation."""
+    return Proposal(runinfo.SS, bbeta,
+                    parameters.prior_set.lower_bound,
+                    parameters.prior_set.upper_bound,
+                    parameters.proposal_bounds)
+
+
+def coef_of_var(x, fj, fjmax, pj):
+    """Coefficient of variation of the weights {f(D|M,theta)}^{x - pj}."""
+    q = np.exp((fj - fjmax) * (x - pj))
+    return np.std(q) / np.mean(q)
 
 
-def obj_log_p(x, fj, pj, tol):
+def obj_log_p(x, fj, pj, tol, fjmax=None, display=0):
     """Function to calculate cov given sample likelihoods and annealing
         stage."""
-    fjmax = np.max(fj)
-    q = np.exp((fj - fjmax) * (x - pj))
-    q = q / np.sum(q)
-    CoefVar = (np.std(q) / np.mean(q) - tol) ** 2  # result
-    print(
-        "   pj = %.16f" % pj +
-        "   x = %.16f" % x +
-        "   f(x) = %.16f" % CoefVar,
-        "   tol = " + str(tol))
+    if fjmax is None:
+        fjmax = np.max(fj)
+    CoefVar = (coef_of_var(x, fj, fjmax, pj) - tol) ** 2  # result
+    if display > 2:
+        print(
+            "   pj = %.16f" % pj +
+            "   x = %.16f" % x +
+            "   f(x) = %.16f" % CoefVar,
+            "   tol = " + str(tol))
     return CoefVar
 
 
+def cov_residual(x, fj, fjmax, pj, tolCOV, display=0):
+    """COV(x) - tolCOV, the function whose root is the next annealing
+    exponent. With display > 2 every evaluation is printed, so the
+    iterations of the root finder can be followed."""
+    residual = coef_of_var(x, fj, fjmax, pj) - tolCOV
+    if display > 2:
+        print(
+            "   pj = %.16f" % pj +
+            "   x = %.16f" % x +
+            "   COV(x) - tol = %.16f" % residual)
+    return residual
+
+
+def solve_annealing_exponent(fj, pj, tolCOV, tol, maxIter, display):
+    """Find the next annealing exponent x > pj with COV(x) = tolCOV.
+
+    The COV of the weights grows monotonically with x - pj and is zero at
+    x = pj, so the root is bracketed by [pj, 1] unless COV(1) is already
+    below tolCOV, in which case the last stage p = 1 is reached. Returns
+    x, the objective (COV(x) - tolCOV)^2 and whether the solver converged.
+    """
+    fjmax = np.max(fj)
+    fmax = cov_residual(1.0, fj, fjmax, pj, tolCOV, display)
+    if pj >= 1 or fmax <= 0:
+        xmin, conv, calls = 1.0, True, 1
+    else:
+        xmin, res = optimize.brentq(
+            cov_residual, pj, 1.0, args=(fj, fjmax, pj, tolCOV, display),
+            xtol=tol, maxiter=maxIter, full_output=True, disp=False)
+        conv, calls = res.converged, res.function_calls + 1
+    fmin = obj_log_p(xmin, fj, pj, tolCOV, fjmax=fjmax, display=display)
+    if display > 1:
+        print("annealing exponent: conv = " + str(conv) + " xmin = " +
+              str(xmin) + " fmin = " + str(fmin) + " evaluations = " +
+              str(calls))
+    return xmin, fmin, conv
+
+
 def chaintask(in_tparam, pnsteps, out_tparam, winfo, runinfo, parameters,
               curgen_db, loglikelihood):
     """Initialize Markov Chain"""
@@ -439,13 +1132,22 @@ def chaintask(in_tparam, pnsteps, out_tparam, winfo, runinfo, parameters,
     chain_id = winfo[1]
     burn_in = parameters.burn_in
 
-    leader = np.zeros(parameters.dimension, dtype=np.float)
+    leader = np.zeros(parameters.dimension, dtype=float)
 
     for i in range(parameters.dimension):
         leader[i] = in_tparam[i]  # get leader
     loglik_leader = out_tparam[0]  # and their function value
+    logprior_leader = out_tparam[1]  # and their log-prior
     pj = runinfo.p[runinfo.Gen]
 
+    surrogate = runinfo.surrogate
+    if surrogate is not None and surrogate.ready():
+        chaintask_screened(leader, loglik_leader, logprior_leader, nsteps,
+                           runinfo, parameters, curgen_db, loglikelihood)
+        return
+
+    # uniform numbers of the accept tests, drawn at once
+    u = uniformrand(0, 1, size=nsteps+burn_in)
     for step in range(nsteps+burn_in):
         # Compute candidate by drawing from normal distribution
         # centered at leader with covariance of S
@@ -454,70 +1156,471 @@ def chaintask(in_tparam, pnsteps, out_tparam, winfo, runinfo, parameters,
 
         logprior_candidate = logpriorpdf(candidate, n=parameters.dimension,
                                          parameters=parameters)
-        logprior_leader = logpriorpdf(leader, n=parameters.dimension,
-                                      parameters=parameters)
         # without exp, with log in logpriorpdf and fitfun
         L = (logprior_candidate - logprior_leader) + (loglik_candidate -
                                                       loglik_leader) * pj
+        L += runinfo.proposal.log_ratio(leader, candidate)
 
-        if (L > 1):
-            L = 1
-
-        if (uniformrand(0, 1) < L):  # Accept candidate with probability L
+        if (np.log(u[step]) < L):  # Accept with probability e^L
+            runinfo.proposal.naccepted += 1
             leader = candidate
             loglik_leader = loglik_candidate
+            logprior_leader = logprior_candidate
             if step >= burn_in:     # Discard first burn_in runs
-                curgen_db.update(leader, loglik_candidate, parameters)
+                curgen_db.update(leader, loglik_candidate, logprior_leader,
+                                 parameters)
         else:   # Discard candidate and add current leader with probability 1-L
             if step >= burn_in:
-                curgen_db.update(leader, loglik_leader, parameters)
+                curgen_db.update(leader, loglik_leader, logprior_leader,
+                                 parameters)
+    return
+
+
+def chaintask_screened(leader, loglik_leader, logprior_leader, nsteps, runinfo,
+                       parameters, curgen_db, loglikelihood):
+    """Markov chain with delayed acceptance: a candidate is first accepted
+       or rejected with the emulated log-likelihood, the model is evaluated
+       only for candidates that pass. The second stage corrects for the
+       emulator error, so the chain samples the same distribution."""
+    burn_in = parameters.burn_in
+    pj = runinfo.p[runinfo.Gen]
+    surrogate = runinfo.surrogate
+    surrogate_leader = surrogate(leader)
+    # uniform numbers of the two accept tests, drawn at once
+    u = uniformrand(0, 1, size=(nsteps+burn_in, 2))
+
+    for step in range(nsteps+burn_in):
+        candidate = propose_candidate(leader, parameters, runinfo)
+        logprior_candidate = logpriorpdf(candidate, n=parameters.dimension,
+                                         parameters=parameters)
+        surrogate_candidate = surrogate(candidate)
+        L = (logprior_candidate - logprior_leader) + (surrogate_candidate -
+                                                      surrogate_leader) * pj
+        # the proposal correction enters the first stage only
+        L += runinfo.proposal.log_ratio(leader, candidate)
+        surrogate.nscreened += 1
+        accept = np.log(u[step, 0]) < L
+        if accept:
+            loglik_candidate = loglikelihood(candidate)
+            L = ((loglik_candidate - loglik_leader) -
+                 (surrogate_candidate - surrogate_leader)) * pj
+            accept = np.log(u[step, 1]) < L
+        else:
+            surrogate.nrejected += 1
+
+        if accept:
+            runinfo.proposal.naccepted += 1
+            leader = candidate
+            loglik_leader = loglik_candidate
+            logprior_leader = logprior_candidate
+            surrogate_leader = surrogate_candidate
+        if step >= burn_in:     # Discard first burn_in runs
+            curgen_db.update(leader, loglik_leader, logprior_leader,
+                             parameters)
     return
 
 
-def dump_curgen_db(Gen, parameters, curgen_db):
-    """Print theta and lik to curgen_db_GEN.txt file. This file can be used
-        for plotting."""
-    with open("curgen_db_" + "{0:0=3d}".format(Gen) + ".txt", "w") as f:
-        for pos in range(curgen_db.entries):
-            for i in range(parameters.dimension):
-                f.write(str(curgen_db.entry[pos].point[i]) + " ")
-            f.write(str(curgen_db.entry[pos].F) + "\n")
+def chaintask_lockstep(leaders, nchains, runinfo, parameters, curgen_db,
+                       loglikelihood):
+    """Advance the Markov chains of all leaders together. Every step issues a
+       single batched likelihood call for the candidates of all chains that
+       are still running. The samples are stored in chain order."""
+    burn_in = parameters.burn_in
+    pj = runinfo.p[runinfo.Gen]
+
+    points = leaders.points[:nchains].copy()
+    loglik = leaders.F[:nchains].copy()
+    logprior = leaders.logprior[:nchains].copy()
+    nsteps = leaders.nsel[:nchains] + burn_in
+    surrogate = runinfo.surrogate
+    if surrogate is not None and surrogate.ready():
+        chaintask_lockstep_screened(points, loglik, logprior, nsteps, runinfo,
+                                    parameters, curgen_db, loglikelihood)
+        return
+    first, samples, F, logprior_samples = chain_samples(nsteps, burn_in,
+                                                        parameters)
+
+    for step in range(np.max(nsteps)):
+        active = np.flatnonzero(nsteps > step)
+        candidates = runinfo.proposal.propose_all(points[active])
+        loglik_candidates = loglikelihood.batch(candidates)
+        logprior_candidates = logpriorpdf(candidates, n=parameters.dimension,
+                                          parameters=parameters)
+        u = uniformrand(0, 1, size=len(active))
+        ratio = runinfo.proposal.log_ratio(points[active], candidates)
+
+        for k, i in enumerate(active):
+            L = (logprior_candidates[k] - logprior[i]) + (
+                    loglik_candidates[k] - loglik[i]) * pj + ratio[k]
+
+            if (np.log(u[k]) < L):  # Accept with probability e^L
+                runinfo.proposal.naccepted += 1
+                points[i] = candidates[k]
+                loglik[i] = loglik_candidates[k]
+                logprior[i] = logprior_candidates[k]
+            if step >= burn_in:     # Discard first burn_in runs
+                samples[first[i] + step] = points[i]
+                F[first[i] + step] = loglik[i]
+                logprior_samples[first[i] + step] = logprior[i]
+    curgen_db.extend(samples, F, logprior_samples, parameters)
+
+
+def chaintask_lockstep_screened(points, loglik, logprior, nsteps, runinfo,
+                                parameters, curgen_db, loglikelihood):
+    """Lockstep chains with delayed acceptance, see chaintask_screened. The
+       model is evaluated in one batch for the candidates that pass the
+       emulator stage."""
+    burn_in = parameters.burn_in
+    pj = runinfo.p[runinfo.Gen]
+    surrogate = runinfo.surrogate
+    surrogate_points = surrogate(points)
+    first, samples, F, logprior_samples = chain_samples(nsteps, burn_in,
+                                                        parameters)
+
+    for step in range(np.max(nsteps)):
+        active = np.flatnonzero(nsteps > step)
+        candidates = runinfo.proposal.propose_all(points[active])
+        logprior_candidates = logpriorpdf(candidates, n=parameters.dimension,
+                                          parameters=parameters)
+        surrogate_candidates = surrogate(candidates)
+        L = (logprior_candidates - logprior[active]) + (
+                surrogate_candidates - surrogate_points[active]) * pj + \
+            runinfo.proposal.log_ratio(points[active], candidates)
+        u = uniformrand(0, 1, size=(2, len(active)))
+        passed = np.log(u[0]) < L
+        surrogate.nscreened += len(active)
+        surrogate.nrejected += len(active) - np.count_nonzero(passed)
+
+        loglik_candidates = np.full(len(active), -np.inf)
+        if np.any(passed):
+            loglik_candidates[passed] = loglikelihood.batch(
+                                                        candidates[passed])
+
+        for k, i in enumerate(active):
+            if passed[k]:
+                L = ((loglik_candidates[k] - loglik[i]) -
+                     (surrogate_candidates[k] - surrogate_points[i])) * pj
+                if np.log(u[1, k]) < L:
+                    runinfo.proposal.naccepted += 1
+                    points[i] = candidates[k]
+                    loglik[i] = loglik_candidates[k]
+                    logprior[i] = logprior_candidates[k]
+                    surrogate_points[i] = surrogate_candidates[k]
+            if step >= burn_in:     # Discard first burn_in runs
+                samples[first[i] + step] = points[i]
+                F[first[i] + step] = loglik[i]
+                logprior_samples[first[i] + step] = logprior[i]
+    curgen_db.extend(samples, F, logprior_samples, parameters)
+
+
+def chain_samples(nsteps, burn_in, parameters):
+    """Arrays for the samples of chains of nsteps steps, their
+       log-likelihoods and log-priors, stored chain after chain, and the
+       row first[k] + step of chain k after step step."""
+    nsel = nsteps - burn_in
+    first = np.cumsum(nsel) - nsel - burn_in
+    samples = np.empty((np.sum(nsel), parameters.dimension), dtype=float)
+    F = np.empty(len(samples), dtype=float)
+    logprior = np.empty(len(samples), dtype=float)
+    return first, samples, F, logprior
+
+
+def chaintask_vectorized(leaders, nchains, runinfo, parameters, curgen_db,
+                         loglikelihood):
+    """Run the Markov chains of all leaders as array operations. As in the
+       chain engine, chain k runs burn_in + nsel[k] steps from its leader
+       and keeps the states after the burn-in. All running chains advance
+       together: proposals, priors, likelihoods and the accept tests of a
+       step are evaluated for all of them at once, and a chain drops out
+       once it has made its own number of steps. The samples are stored in
+       chain order."""
+    burn_in = parameters.burn_in
+    pj = runinfo.p[runinfo.Gen]
+    proposal = runinfo.proposal
+    nsel = leaders.nsel[:nchains]
+
+    # Chains sorted by length, so the running chains are always a prefix
+    order = np.argsort(-nsel, kind='stable')
+    nsteps = nsel[order] + burn_in
+    points = leaders.points[:nchains][order]
+    loglik = leaders.F[:nchains][order]
+    logprior = leaders.logprior[:nchains][order]
+    first, samples, F, logprior_samples = chain_samples(nsel + burn_in,
+                                                        burn_in, parameters)
+    first = first[order]
+
+    surrogate = runinfo.surrogate
+    screened = surrogate is not None and surrogate.ready()
+    if screened:
+        surrogate_points = surrogate(points)
+
+    running = nchains
+    for step in range(np.max(nsteps, initial=0)):
+        while nsteps[running - 1] <= step:
+            running -= 1
+        n = running
+        candidates = proposal.propose_all(points[:n])
+        logprior_candidates = logpriorpdf(candidates, n=parameters.dimension,
+                                          parameters=parameters)
+        if screened:
+            # delayed acceptance, see chaintask_screened
+            surrogate_candidates = surrogate(candidates)
+            L = (logprior_candidates - logprior[:n]) + (
+                    surrogate_candidates - surrogate_points[:n]) * pj + \
+                proposal.log_ratio(points[:n], candidates)
+            passed = np.log(uniformrand(0, 1, size=n)) < L
+            surrogate.nscreened += n
+            surrogate.nrejected += n - np.count_nonzero(passed)
+
+            loglik_candidates = np.full(n, -np.inf)
+            if np.any(passed):
+                loglik_candidates[passed] = loglikelihood.batch(
+                                                        candidates[passed])
+            L = ((loglik_candidates - loglik[:n]) -
+                 (surrogate_candidates - surrogate_points[:n])) * pj
+            accept = passed & (np.log(uniformrand(0, 1, size=n)) < L)
+            surrogate_points[:n][accept] = surrogate_candidates[accept]
+        else:
+            loglik_candidates = loglikelihood.batch(candidates)
+            L = (logprior_candidates - logprior[:n]) + (
+                    loglik_candidates - loglik[:n]) * pj + \
+                proposal.log_ratio(points[:n], candidates)
+            # Accept candidates with probability e^L
+            accept = np.log(uniformrand(0, 1, size=n)) < L
+
+        proposal.naccepted += np.count_nonzero(accept)
+        points[:n][accept] = candidates[accept]
+        loglik[:n][accept] = loglik_candidates[accept]
+        logprior[:n][accept] = logprior_candidates[accept]
+        if step >= burn_in:     # Discard first burn_in runs
+            rows = first[:n] + step
+            samples[rows] = points[:n]
+            F[rows] = loglik[:n]
+            logprior_samples[rows] = logprior[:n]
+
+    curgen_db.extend(samples, F, logprior_samples, parameters)
+
+
+# Per-process state of the workers of the parallel chain execution
+_worker = {}
+
+
+def init_worker(parameters):
+    """Load model function and data once per worker process."""
+    _worker['parameters'] = parameters
+    _worker['loglikelihood'] = TimedLikelihood(LogLikelihood(
+        parameters.model_file, parameters.data_file, parameters))
+
+
+def run_chains(points, F, logprior, nsel, seeds, runinfo, parameters,
+               curgen_db, loglikelihood):
+    """Run the chains of the leaders points one after the other. Chain i
+    draws from its own stream seeded by seeds[i], derived from (seed,
+    generation, chain index), so the result does not depend on how the
+    chains are distributed over processes."""
+    out_tparam = np.zeros(2, dtype=float)
+    winfo = np.zeros(4, dtype=int)
+    winfo[0] = runinfo.Gen
+    main_generator = get_generator()
+    try:
+        for i in range(len(points)):
+            set_generator(make_generator(seeds[i], parameters.rng))
+            runinfo.proposal.reset(nsel[i] + parameters.burn_in)
+            winfo[1] = i
+            out_tparam[0] = F[i]
+            out_tparam[1] = logprior[i]
+            chaintask(in_tparam=points[i], pnsteps=nsel[i],
+                      out_tparam=out_tparam, winfo=winfo, runinfo=runinfo,
+                      parameters=parameters, curgen_db=curgen_db,
+                      loglikelihood=loglikelihood)
+    finally:
+        set_generator(main_generator)
+
+
+def run_chain_chunk(args):
+    """Run a chunk of leader chains in a worker process."""
+    runinfo, points, F, logprior, nsel, seeds = args
+    parameters = _worker['parameters']
+    loglikelihood = _worker['loglikelihood']
+    timers.reset()
+    curgen_db = GenerationDB()
+    curgen_db.init(parameters)
+    run_chains(points, F, logprior, nsel, seeds, runinfo, parameters,
+               curgen_db, loglikelihood)
+
+    n = curgen_db.entries
+    screened = surrogate_counts(runinfo)
+    return (curgen_db.points[:n], curgen_db.F[:n], curgen_db.logprior[:n],
+            runinfo.proposal.counts(), screened, timers.state())
+
+
+def chaintask_parallel(executor, seed, leaders, nchains, runinfo, parameters,
+                       curgen_db, loglikelihood):
+    """Distribute the leader chains of the current generation over the
+    process pool and merge the samples into curgen_db in chain order."""
+    chain_runinfo = RunInfo()
+    chain_runinfo.Gen = runinfo.Gen
+    chain_runinfo.p = runinfo.p[:runinfo.Gen+1].copy()
+    chain_runinfo.SS = runinfo.SS.copy()
+    chain_runinfo.proposal = copy.copy(runinfo.proposal)
+    chain_runinfo.surrogate = None
+    if runinfo.surrogate is not None and runinfo.surrogate.ready():
+        # Only the fitted emulator is needed by the chains
+        chain_runinfo.surrogate = copy.copy(runinfo.surrogate)
+        chain_runinfo.surrogate.points = None
+        chain_runinfo.surrogate.values = None
+
+    seeds = chain_seeds(seed, runinfo.Gen, nchains)
+    chunks = []
+    for start in range(0, nchains, parameters.chunk_size):
+        idx = slice(start, min(start + parameters.chunk_size, nchains))
+        chunks.append((chain_runinfo, leaders.points[idx], leaders.F[idx],
+                       leaders.logprior[idx], leaders.nsel[idx],
+                       seeds[idx]))
+
+    for points, F, logprior, proposal_counts, screened, state in \
+            executor.map(run_chain_chunk, chunks):
+        curgen_db.extend(points, F, logprior, parameters)
+        # times of the workers are summed over the processes
+        timers.merge(state)
+        runinfo.proposal.add_counts(*proposal_counts)
+        if runinfo.surrogate is not None:
+            runinfo.surrogate.nscreened += screened[0]
+            runinfo.surrogate.nrejected += screened[1]
+
+
+def dump_curgen_db(Gen, parameters, curgen_db, writer, output):
+    """Write theta and lik of the generation with the sample writer, by
+        default to curgen_db_GEN.npy. The files can be used for plotting.
+        The write is handed to the output thread on a copy of the arrays."""
+    start = timer()
+    n = curgen_db.entries
+    output.submit(writer.write, Gen, curgen_db.points[:n].copy(),
+                  curgen_db.F[:n].copy())
+    timers.add('io', timer() - start)
 
 
 def logpriorpdf(theta, n, parameters):
-    res = 0
-    for i in range(n):
-        res += parameters.priors[i].logpriorpdf(theta[i])
-    return res
+    """Log prior density of theta[n], or of every row of theta[N, n]."""
+    start = timer()
+    logprior = parameters.prior_set.logpdf(theta)
+    timers.add('prior', timer() - start)
+    return logprior
 
 #@profile
 def propose_candidate(leader, parameters, runinfo):
     """ Sample a candidate from the multivariate_normal, centered
-        at the chain's leader with variance bSS. """
-    bSS = np.empty((parameters.dimension, parameters.dimension), dtype=np.float)
-    for i in range(parameters.dimension):
-        for j in range(parameters.dimension):
-            bSS[i][j] = parameters.bbeta * runinfo.SS[i][j]
-
-    # Generate random numbers until RN inside parameters range
-    while(True):
-        flag = 0
-        candidate = np.random.multivariate_normal(leader, bSS)
-        for i in range(parameters.dimension):
-            assert (np.isnan(candidate[i]) is not False), \
-                     "Nan in candidate point! - Something went wrong!!!!" +\
-                     str(candidate[i])
-# TODO what lower_bound now?
-            if ((candidate[i] < parameters.priors[i].lower_bound) or (
-                    candidate[i] > parameters.priors[i].upper_bound)):
-                flag = 1
-                break
-        if (flag == 0):
-            break
+        at the chain's leader with variance bbeta*SS, inside the
+        parameters range. """
+    candidate = runinfo.proposal(leader)
+    assert not np.any(np.isnan(candidate)), \
+        "Nan in candidate point! - Something went wrong!!!!" + str(candidate)
     return candidate
 
 
-def tmcmc():
+def update_surrogate(runinfo, parameters, curgen_db):
+    """Add the samples of the generation to the training points of the
+    emulator and refit it every refit_interval generations, starting with
+    generation start_generation."""
+    surrogate = runinfo.surrogate
+    n = curgen_db.entries
+    points, F = curgen_db.points[:n], curgen_db.F[:n]
+    if n > surrogate.max_points:
+        # evenly spaced subset, the generation holds many repeated points
+        idx = np.unique(np.linspace(0, n - 1, surrogate.max_points,
+                                    dtype=int))
+        points, F = points[idx], F[idx]
+    surrogate.add(points, F)
+
+    Gen = runinfo.Gen + 1   # generation that will use the emulator
+    if Gen >= parameters.surrogate_start and (
+            not surrogate.ready() or
+            (Gen - parameters.surrogate_start) %
+            parameters.surrogate_refit == 0):
+        surrogate.fit()
+
+
+def surrogate_counts(runinfo):
+    """Candidates screened and rejected by the emulator since the last
+    reset."""
+    if runinfo.surrogate is None:
+        return (0, 0)
+    return (runinfo.surrogate.nscreened, runinfo.surrogate.nrejected)
+
+
+def report_surrogate(runinfo, display):
+    """Store and print the number of model evaluations saved by the
+    emulator in the generation."""
+    surrogate = runinfo.surrogate
+    if surrogate is None:
+        return
+    runinfo.surrogate_screened[runinfo.Gen] = surrogate.nscreened
+    runinfo.surrogate_rejected[runinfo.Gen] = surrogate.nrejected
+    surrogate.reset()
+    if display > 1:
+        print("surrogate: screened = " +
+              str(int(runinfo.surrogate_screened[runinfo.Gen])) +
+              " model evaluations saved = " +
+              str(int(runinfo.surrogate_rejected[runinfo.Gen])) +
+              " total saved = " +
+              str(int(np.sum(runinfo.surrogate_rejected[:runinfo.Gen+1]))))
+
+
+def report_proposals(runinfo, display):
+    """Store and print the number of proposal draws and the acceptance rate
+    of the generation."""
+    proposal = runinfo.proposal
+    draws = proposal.ndraws / max(proposal.nproposals, 1)
+    runinfo.proposal_draws[runinfo.Gen] = draws
+    runinfo.acceptance[runinfo.Gen] = (proposal.naccepted /
+                                       max(proposal.nproposals, 1))
+    if display > 1:
+        print("proposals = " + str(proposal.nproposals) + " draws = " +
+              str(proposal.ndraws) + " draws per proposal = " + str(draws) +
+              " acceptance = " + str(runinfo.acceptance[runinfo.Gen]))
+
+
+def generation_metrics(runinfo, Gen, nchains, nsamples, wall_time):
+    """Metrics of generation Gen: annealing exponent, COV and effective
+    sample size of the weights, acceptance rate, model evaluations and the
+    wall time per category. Times of worker processes are summed."""
+    record = {'Gen': Gen,
+              'p': float(runinfo.p[Gen]),
+              'p_next': float(runinfo.p[Gen+1]),
+              'CoefVar': float(runinfo.CoefVar[Gen]),
+              'acceptance': float(runinfo.acceptance[Gen]) if Gen > 0
+              else None,
+              'ess': float(runinfo.ess[Gen]),
+              'evaluations': int(timers.evaluations),
+              'nchains': int(nchains),
+              'samples': int(nsamples),
+              'bbeta': float(runinfo.bbeta[Gen])}
+    for category, seconds in timers.times.items():
+        record['time_' + category] = seconds
+    record['time_total'] = wall_time
+    return record
+
+
+def report_generation(record, display, metrics, output):
+    """Write the metrics of a generation and print them as one line."""
+    if metrics is not None:
+        output.submit(metrics.write, record)
+    if display == 1:
+        line = "Gen " + str(record['Gen']) + ": p = " + \
+            "{0:.6g}".format(record['p_next']) + " CoefVar = " + \
+            "{0:.4g}".format(record['CoefVar'])
+        if record['acceptance'] is not None:
+            line += " acceptance = " + \
+                "{0:.3f}".format(record['acceptance'])
+        line += " ESS = " + "{0:.1f}".format(record['ess']) + \
+            " evaluations = " + str(record['evaluations']) + " time = " + \
+            "{0:.2f}".format(record['time_total']) + " s"
+        print(line)
+
+
+def tmcmc(resume=None):
+    """Run TMCMC. resume is the checkpoint file to continue from, True for
+    the checkpoint file of tmcmc.par or None to start a new run."""
 
     options = OptimOptions()
     parameters = Parameters(options)
@@ -526,68 +1629,155 @@ def tmcmc():
     runinfo = RunInfo()
     runinfo.init_runinfo(parameters)
 
+    display = parameters.options.display
+    loglikelihood = TimedLikelihood(LogLikelihood(
+        parameters.model_file, parameters.data_file, parameters))
 
+    leaders = GenerationDB()
+    leaders.init(parameters)
+    leaders.nsel = np.zeros(parameters.PopSize + 1, dtype=int)
 
-    loglikelihood = LogLikelihood(parameters.model_file, parameters.data_file,
-                                  parameters)
-    # Set random seed
-    if parameters.seed != -1:
-        np.random.seed(parameters.seed)
-
-    out_tparam = np.zeros(parameters.PopSize, dtype=np.float)
-    winfo = np.zeros(4, dtype=np.int)
-    in_tparam = np.zeros(parameters.dimension, dtype=np.float)
-
-    nchains = parameters.Num[0]
-    curgen_db.entries = 0
-
-    # Randomly select nchains starting points c from prior pdf,
-    # calculate function value F(c) from posterior distribution, and
-    # put results in curgen_db
-    for i in range(int(nchains)):
-        winfo[0] = runinfo.Gen
-        winfo[1] = i
-        for d in range(parameters.dimension):
-            in_tparam[d] = parameters.priors[d].sample()
-        init_chaintask(in_tparam, parameters, curgen_db, loglikelihood)
-    curgen_db.print_size()
-
-    # dump curgen database for plotting
-    dump_curgen_db(runinfo.Gen, parameters, curgen_db)
-
-    leaders = np.empty(parameters.PopSize, dtype=object)
-    for i in range(parameters.PopSize):
-        leaders[i] = GenerationDB()
-        leaders[i].point = np.empty(parameters.dimension, dtype=np.float)
-
-    nchains = prepare_newgen(nchains=nchains, leaders=leaders,
-                             curgen_db=curgen_db, parameters=parameters,
-                             runinfo=runinfo)
-    runinfo.Gen += 1
-    while runinfo.Gen < parameters.MaxStages:
-        for i in range(nchains):
-            winfo[0] = runinfo.Gen
-            winfo[1] = i
-            in_tparam = np.zeros(parameters.dimension)
-            for p in range(parameters.dimension):
-                in_tparam[p] = leaders[i].point[p]
-            nsteps = leaders[i].nsel
-            out_tparam[0] = leaders[i].F
-            chaintask(in_tparam=in_tparam, pnsteps=nsteps,
-                      out_tparam=out_tparam,
-                      winfo=winfo, runinfo=runinfo, parameters=parameters,
-                      curgen_db=curgen_db, loglikelihood=loglikelihood)
-        curgen_db.print_size()
-        dump_curgen_db(runinfo.Gen, parameters, curgen_db)
-        nchains = prepare_newgen(nchains, leaders, curgen_db, parameters=parameters,
-                                 runinfo=runinfo)
-        if runinfo.p[runinfo.Gen] == 1:
-            print("p == 1 - finished")
-            break
-        print("Generation = " + str(runinfo.Gen) + " p = " +
-              str(runinfo.p[1:runinfo.Gen+1]))
-        runinfo.Gen += 1
+    writer = make_sample_writer(parameters.sample_format,
+                                parameters.text_export, parameters.hdf5_file)
+    if parameters.async_output:
+        output = AsyncWriter(parameters.output_queue_size)
+    else:
+        output = SyncWriter()
+    metrics = None
+    if parameters.metrics_file:
+        # a resumed run continues the metrics of the previous run
+        metrics = MetricsWriter(parameters.metrics_file,
+                                parameters.metrics_format, bool(resume))
+    executor = None
+    try:
+        if resume:
+            if resume is True:
+                resume = parameters.checkpoint_file
+            nchains, chain_seed = runinfo.load_runinfo(resume, parameters,
+                                                       leaders)
+            runinfo.seed = chain_seed
+            if display:
+                print("Resuming from " + resume + " at generation " +
+                      str(runinfo.Gen))
+        else:
+            # Root seed of the main generator and of the per-chain streams
+            if parameters.seed != -1:
+                chain_seed = parameters.seed
+            else:
+                chain_seed = np.random.SeedSequence().entropy
+            seed_generator(chain_seed, parameters.rng)
+            runinfo.seed = chain_seed
+
+            nchains = parameters.Num[0]
+            curgen_db.entries = 0
+            timers.reset()
+            start = timer()
+
+            # Randomly select nchains starting points c from prior pdf,
+            # calculate function value F(c) from posterior distribution, and
+            # put results in curgen_db
+            in_tparams = parameters.prior_set.sample(int(nchains))
+            init_chaintask_batch(in_tparams, parameters, curgen_db,
+                                 loglikelihood)
+            nsamples = curgen_db.entries
+            if display > 1:
+                curgen_db.print_size()
+
+            # dump curgen database for plotting
+            dump_curgen_db(runinfo.Gen, parameters, curgen_db, writer,
+                           output)
+
+            newchains = prepare_newgen(nchains=nchains, leaders=leaders,
+                                       curgen_db=curgen_db,
+                                       parameters=parameters, runinfo=runinfo)
+            runinfo.Gen += 1
+            save_checkpoint(runinfo, parameters, leaders, newchains,
+                            curgen_db, nsamples, chain_seed, output)
+            report_generation(generation_metrics(runinfo, 0, nchains,
+                                                 nsamples, timer() - start),
+                              display, metrics, output)
+            nchains = newchains
+
+        if parameters.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=parameters.workers,
+                                           initializer=init_worker,
+                                           initargs=(parameters,))
+
+        while runinfo.Gen < parameters.MaxStages:
+            Gen = runinfo.Gen
+            timers.reset()
+            start = timer()
+            if parameters.engine == 'vectorized':
+                chaintask_vectorized(leaders, nchains, runinfo, parameters,
+                                     curgen_db, loglikelihood)
+            elif parameters.engine == 'lockstep':
+                chaintask_lockstep(leaders, nchains, runinfo, parameters,
+                                   curgen_db, loglikelihood)
+            elif executor is not None:
+                chaintask_parallel(executor, chain_seed, leaders, nchains,
+                                   runinfo, parameters, curgen_db,
+                                   loglikelihood)
+            else:
+                run_chains(leaders.points[:nchains], leaders.F[:nchains],
+                           leaders.logprior[:nchains], leaders.nsel[:nchains],
+                           chain_seeds(chain_seed, runinfo.Gen, nchains),
+                           runinfo, parameters, curgen_db, loglikelihood)
+            nsamples = curgen_db.entries
+            if display > 1:
+                curgen_db.print_size()
+            report_proposals(runinfo, display)
+            report_surrogate(runinfo, display)
+            dump_curgen_db(Gen, parameters, curgen_db, writer, output)
+            newchains = prepare_newgen(nchains, leaders, curgen_db,
+                                       parameters=parameters, runinfo=runinfo)
+            finished = runinfo.p[Gen] == 1
+            if not finished:
+                if display > 1:
+                    print("Generation = " + str(Gen) + " p = " +
+                          str(runinfo.p[1:Gen+1]))
+                runinfo.Gen += 1
+                save_checkpoint(runinfo, parameters, leaders, newchains,
+                                curgen_db, nsamples, chain_seed, output)
+            report_generation(generation_metrics(runinfo, Gen, nchains,
+                                                 nsamples, timer() - start),
+                              display, metrics, output)
+            nchains = newchains
+            if finished:
+                if display > 1:
+                    print("p == 1 - finished")
+                report_evidence(runinfo, parameters, output)
+                break
+    finally:
+        # Flush pending output so no generation is lost, also on error
+        try:
+            output.close()
+        finally:
+            writer.close()
+            if metrics is not None:
+                metrics.close()
+            if executor is not None:
+                executor.shutdown()
+
+
+def save_checkpoint(runinfo, parameters, leaders, nchains, curgen_db,
+                    nsamples, chain_seed, output):
+    """Checkpoint the run at the start of generation runinfo.Gen. The state
+    is copied immediately and written by the output thread."""
+    start = timer()
+    if parameters.checkpoint_file:
+        output.submit(write_checkpoint, parameters.checkpoint_file,
+                      runinfo.checkpoint_state(parameters, leaders, nchains,
+                                               curgen_db, nsamples,
+                                               chain_seed))
+    timers.add('io', timer() - start)
 
 
 if __name__ == '__main__':
-    tmcmc()
+    parser = argparse.ArgumentParser(description='Run TMCMC.')
+    parser.add_argument('--resume', nargs='?', const=True, default=None,
+                        metavar='CHECKPOINT',
+                        help='Continue from the last completed generation ' +
+                        'stored in CHECKPOINT (default: checkpoint_file ' +
+                        'of tmcmc.par).')
+    args = parser.parse_args()
+    tmcmc(args.resume)
@@ -0,0 +1,100 @@
+# *
+# *  surrogate.py
+# *  PyPi4U
+# *
+# *  Authors:
+# *     Philipp Mueller  - muellphi@ethz.ch
+# *     Georgios Arampatzis - arampatzis@collegium.ethz.ch
+# *     Panagiotis Chatzidoukas
+# *  Copyright 2018 ETH Zurich. All rights reserved.
+# *
+
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+
+class RBFSurrogate():
+    """ Cheap emulator of the log-likelihood: cubic radial basis function
+        interpolant with a linear polynomial tail. The inputs are scaled by
+        the standard deviation of the training points.
+
+        Training points are collected with add() and the emulator is
+        rebuilt with fit(). At most max_points training points are used,
+        the most recently added ones are kept. """
+    def __init__(self, max_points=500):
+        self.max_points = max_points
+        self.points = None          # pool of model evaluations
+        self.values = None
+        self.fit_points = None      # training set of the current fit
+        self.fit_values = None
+        self.weights = None
+        self.nscreened = 0          # candidates screened by the emulator
+        self.nrejected = 0          # rejected without running the model
+
+    def add(self, points, values):
+        """ Add the model evaluations values[N] at points[N, d]. Repeated
+            points and non-finite values are skipped. """
+        points = np.atleast_2d(points)
+        values = np.atleast_1d(values)
+        finite = np.isfinite(values)
+        points, values = points[finite], values[finite]
+        if self.points is not None:
+            points = np.concatenate((self.points, points))
+            values = np.concatenate((self.values, values))
+        # keep the last occurrence of every point, in order of insertion
+        _, idx = np.unique(points[::-1], axis=0, return_index=True)
+        idx = np.sort(len(points) - 1 - idx)
+        if len(idx) > self.max_points:
+            idx = idx[-self.max_points:]
+        self.points = points[idx]
+        self.values = values[idx]
+
+    def fit(self, points=None, values=None):
+        """ Fit the emulator to the pool, or to the given training set.
+            Returns False if there are too few points for a fit. """
+        if points is None:
+            points, values = self.points, self.values
+        if points is None or len(points) < points.shape[1] + 2:
+            self.weights = None
+            return False
+        self.fit_points = points
+        self.fit_values = values
+
+        self.center = np.mean(points, axis=0)
+        self.scale = np.std(points, axis=0)
+        self.scale[self.scale == 0] = 1
+        x = (points - self.center) / self.scale
+        n, d = x.shape
+
+        P = np.hstack((np.ones((n, 1)), x))
+        A = np.zeros((n + d + 1, n + d + 1))
+        A[:n, :n] = cdist(x, x)**3
+        A[:n, n:] = P
+        A[n:, :n] = P.T
+        rhs = np.concatenate((values, np.zeros(d + 1)))
+        try:
+            coef = np.linalg.solve(A, rhs)
+        except np.linalg.LinAlgError:
+            coef = np.linalg.lstsq(A, rhs, rcond=None)[0]
+        self.x = x
+        self.weights = coef[:n]
+        self.poly = coef[n:]
+        return True
+
+    def ready(self):
+        return self.weights is not None
+
+    def __call__(self, theta):
+        """ Emulated log-likelihood of theta[d], or of every row of
+            theta[N, d]. """
+        x = (np.atleast_2d(theta) - self.center) / self.scale
+        values = cdist(x, self.x)**3 @ self.weights + \
+            self.poly[0] + x @ self.poly[1:]
+        if np.ndim(theta) == 1:
+            return values[0]
+        return values
+
+    def reset(self):
+        self.nscreened = 0
+        self.nrejected = 0
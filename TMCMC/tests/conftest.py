@@ -0,0 +1,12 @@
+# *
+# *  conftest.py
+# *  PyPi4U
+# *
+# *  The TMCMC modules import each other as top-level modules, so the
+# *  TMCMC directory is put on the path of the tests.
+# *
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
@@ -0,0 +1,78 @@
+# *
+# *  test_checkpoint.py
+# *  PyPi4U
+# *
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import random_auxiliary
+import sequential_tmcmc
+
+TMCMC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_run(path, settings):
+    """ Copy the example of the TMCMC directory to path with the values of
+        the given settings of tmcmc.par replaced """
+    for name in ('common_parameters.par', 'data.txt'):
+        shutil.copy(os.path.join(TMCMC_DIR, name), str(path))
+    with open(os.path.join(TMCMC_DIR, 'tmcmc.par')) as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        key = line.split('=')[0].strip()
+        if key in settings:
+            lines[i] = key + ' = ' + str(settings[key])
+    with open(os.path.join(str(path), 'tmcmc.par'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def final_samples():
+    return np.load(sorted(glob.glob('curgen_db_*.npy'))[-1])
+
+
+@pytest.mark.parametrize("engine, max_chain_length", [('chain', 0),
+                                                      ('vectorized', 3)])
+def test_resumed_run_matches_the_full_run(tmp_path, monkeypatch, engine,
+                                          max_chain_length):
+    setup_run(tmp_path, {'pop_size': 200, 'seed': 3, 'engine': engine,
+                         'max_chain_length': max_chain_length})
+    monkeypatch.chdir(tmp_path)
+
+    # keep a copy of the checkpoint written at the start of generation 3
+    write_checkpoint = sequential_tmcmc.write_checkpoint
+
+    def keep_checkpoint(filename, state):
+        write_checkpoint(filename, state)
+        if state['Gen'] == 3:
+            shutil.copy(filename, 'gen3.npz')
+    monkeypatch.setattr(sequential_tmcmc, 'write_checkpoint',
+                        keep_checkpoint)
+
+    sequential_tmcmc.tmcmc()
+    full = final_samples()
+    evidence = np.loadtxt('log_evidence.txt')
+    for name in glob.glob('curgen_db_*.npy') + ['log_evidence.txt']:
+        os.remove(name)
+
+    sequential_tmcmc.tmcmc(resume='gen3.npz')
+    # generations before the checkpoint are not written again
+    assert not os.path.exists('curgen_db_002.npy')
+    np.testing.assert_array_equal(final_samples(), full)
+    np.testing.assert_array_equal(np.loadtxt('log_evidence.txt'), evidence)
+
+
+@pytest.mark.parametrize("bit_generator", ['pcg64', 'philox'])
+def test_generator_state_round_trip(bit_generator):
+    random_auxiliary.seed_generator(5, bit_generator)
+    random_auxiliary.standard_normal(3)
+    random_auxiliary.uniformrand(0, 1, size=7)     # inside a Philox block
+    state = random_auxiliary.generator_state()
+    expected = random_auxiliary.standard_normal(10)
+    random_auxiliary.seed_generator(6, bit_generator)
+    random_auxiliary.set_generator_state(state)
+    np.testing.assert_array_equal(random_auxiliary.standard_normal(10),
+                                  expected)
@@ -0,0 +1,42 @@
+# *
+# *  test_engines.py
+# *  PyPi4U
+# *
+import inspect
+
+import numpy as np
+import pytest
+
+import sequential_tmcmc
+from test_checkpoint import setup_run
+
+
+@pytest.mark.parametrize("engine", ['chain', 'lockstep', 'vectorized'])
+def test_samples_carry_their_log_prior(tmp_path, monkeypatch, engine):
+    setup_run(tmp_path, {'pop_size': 100, 'seed': 4, 'engine': engine,
+                         'max_stages': 4})
+    monkeypatch.chdir(tmp_path)
+
+    prepare_newgen = sequential_tmcmc.prepare_newgen
+    signature = inspect.signature(prepare_newgen)
+    generations = []
+
+    def no_prior(*args, **kwargs):
+        raise AssertionError("log-prior of a leader evaluated again")
+
+    def check_samples(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs).arguments
+        curgen_db, parameters = bound['curgen_db'], bound['parameters']
+        n = curgen_db.entries
+        np.testing.assert_allclose(
+            curgen_db.logprior[:n],
+            parameters.prior_set.logpdf(curgen_db.points[:n]))
+        generations.append(n)
+        # the leaders take their log-prior from the samples
+        with monkeypatch.context() as patch:
+            patch.setattr(sequential_tmcmc, 'logpriorpdf', no_prior)
+            return prepare_newgen(*args, **kwargs)
+    monkeypatch.setattr(sequential_tmcmc, 'prepare_newgen', check_samples)
+
+    sequential_tmcmc.tmcmc()
+    assert len(generations) > 1
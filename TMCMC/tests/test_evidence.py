@@ -0,0 +1,32 @@
+# *
+# *  test_evidence.py
+# *  PyPi4U
+# *
+import types
+
+import numpy as np
+
+from sequential_tmcmc import bootstrap_logselection, chain_blocks
+
+
+def test_split_chains_form_one_block():
+    leaders = types.SimpleNamespace(
+        points=np.array([[0.0, 1.0], [0.0, 1.0], [2.0, 1.0], [3.0, 1.0]]),
+        nsel=np.array([2, 1, 3, 1]))
+    np.testing.assert_array_equal(chain_blocks(leaders, 4),
+                                  [0, 0, 0, 1, 1, 1, 2])
+
+
+def test_bootstrap_resamples_whole_chains():
+    # 50 chains of 20 identical weights: the mean weight varies like the
+    # mean of 50 values, not of 1000
+    chain_weight = np.random.default_rng(1).exponential(size=50)
+    weight = np.repeat(chain_weight, 20)
+    blocks = np.repeat(np.arange(50), 20)
+    boot = bootstrap_logselection(weight, blocks, 0.0, 400,
+                                  np.random.default_rng(2))
+    iid = bootstrap_logselection(weight, np.arange(1000), 0.0, 400,
+                                 np.random.default_rng(2))
+    assert boot.shape == (400,)
+    assert abs(np.mean(boot) - np.log(np.mean(weight))) < np.std(boot)
+    assert np.std(boot) > 3 * np.std(iid)
@@ -0,0 +1,73 @@
+# *
+# *  test_output.py
+# *  PyPi4U
+# *
+import numpy as np
+import pytest
+
+import output
+from output import load_samples, make_sample_writer
+
+points = np.random.default_rng(0).normal(size=(50, 3))
+F = -np.arange(50.0) / 7
+
+
+@pytest.mark.parametrize("sample_format, filename", [
+    ('npy', 'curgen_db_004.npy'), ('text', 'curgen_db_004.txt'),
+    ('hdf5', 'tmcmc_samples.h5')])
+def test_samples_round_trip(tmp_path, monkeypatch, sample_format, filename):
+    if sample_format == 'hdf5' and output.h5py is None:
+        pytest.skip("h5py is not installed")
+    monkeypatch.chdir(tmp_path)
+    writer = make_sample_writer(sample_format)
+    writer.write(3, points + 1, F + 1)
+    writer.write(4, points, F)
+    writer.close()
+
+    samples = load_samples(filename)
+    np.testing.assert_array_equal(samples, np.column_stack((points, F)))
+
+
+def test_text_export_writes_both_formats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = make_sample_writer('npy', text_export=True)
+    writer.write(0, points, F)
+    writer.close()
+    np.testing.assert_array_equal(load_samples('curgen_db_000.npy'),
+                                  load_samples('curgen_db_000.txt'))
+
+
+def test_unknown_format_is_an_error():
+    with pytest.raises(ValueError):
+        make_sample_writer('csv')
+
+
+def test_async_writer_runs_tasks_in_order():
+    done = []
+    writer = output.AsyncWriter(maxsize=2)
+    for i in range(20):
+        writer.submit(done.append, i)
+    writer.close()
+    assert done == list(range(20))
+
+
+def test_async_writer_raises_the_error_of_a_task():
+    def fail():
+        raise OSError("disk full")
+    writer = output.AsyncWriter()
+    writer.submit(fail)
+    with pytest.raises(OSError):
+        writer.flush()
+    writer.close()
+
+
+def test_hdf5_last_generation_is_the_highest_number(tmp_path, monkeypatch):
+    if output.h5py is None:
+        pytest.skip("h5py is not installed")
+    monkeypatch.chdir(tmp_path)
+    writer = make_sample_writer('hdf5')
+    writer.write(999, points + 1, F + 1)
+    writer.write(1000, points, F)
+    writer.close()
+    np.testing.assert_array_equal(load_samples('tmcmc_samples.h5'),
+                                  np.column_stack((points, F)))
@@ -0,0 +1,70 @@
+# *
+# *  test_priors.py
+# *  PyPi4U
+# *
+import numpy as np
+import pytest
+from scipy import stats
+
+from priors import (LogNormalPrior, NormalPrior, PriorSet,
+                    TruncatedNormalPrior, UniformPrior)
+
+
+def make_priors():
+    uniform = UniformPrior()
+    uniform.set_bounds(-1.0, 3.0)
+    normal = NormalPrior()
+    normal.set_distribution(0.5, 2.0)
+    lognormal = LogNormalPrior()
+    lognormal.set_distribution(0.2, 0.7)
+    truncated = TruncatedNormalPrior()
+    truncated.set_distribution(1.0, 0.5, 0.0, 2.5)
+    return [uniform, normal, lognormal, truncated]
+
+
+points = np.array([[0.0, 0.5, 1.0, 1.0],
+                   [-0.9, -3.0, 0.1, 0.05],
+                   [2.9, 4.0, 5.0, 2.4]])
+
+
+def test_logpdf_matches_the_single_priors():
+    priors = make_priors()
+    prior_set = PriorSet(priors)
+    expected = [sum(p.logpriorpdf(xi) for p, xi in zip(priors, x))
+                for x in points]
+    np.testing.assert_allclose(prior_set.logpdf(points), expected)
+
+
+def test_logpdf_matches_scipy():
+    prior_set = PriorSet(make_priors())
+    expected = (stats.uniform(-1.0, 4.0).logpdf(points[:, 0]) +
+                stats.norm(0.5, 2.0).logpdf(points[:, 1]) +
+                stats.lognorm(0.7, scale=np.exp(0.2)).logpdf(points[:, 2]) +
+                stats.truncnorm(-2.0, 3.0, loc=1.0, scale=0.5).logpdf(
+                    points[:, 3]))
+    np.testing.assert_allclose(prior_set.logpdf(points), expected)
+
+
+def test_single_point_returns_a_float():
+    prior_set = PriorSet(make_priors())
+    value = prior_set.logpdf(points[0])
+    assert np.ndim(value) == 0
+    assert value == pytest.approx(prior_set.logpdf(points)[0])
+
+
+@pytest.mark.parametrize("dim, value", [(0, -1.5), (0, 3.5), (2, 0.0),
+                                        (2, -1.0), (3, 2.6), (3, -0.1)])
+def test_outside_the_support_is_minus_infinity(dim, value):
+    prior_set = PriorSet(make_priors())
+    x = points.copy()
+    x[1, dim] = value
+    logp = prior_set.logpdf(x)
+    assert logp[1] == -np.inf
+    assert np.all(np.isfinite(logp[[0, 2]]))
+
+
+def test_samples_lie_in_the_support():
+    prior_set = PriorSet(make_priors())
+    x = prior_set.sample(1000)
+    assert x.shape == (1000, 4)
+    assert np.all(np.isfinite(prior_set.logpdf(x)))
@@ -0,0 +1,145 @@
+# *
+# *  test_proposal.py
+# *  PyPi4U
+# *
+import itertools
+import time
+
+import numpy as np
+import pytest
+
+import random_auxiliary as ra
+from sequential_tmcmc import Proposal
+
+
+# Strongly correlated proposal in the unit square
+COV = np.array([[.09, .08], [.08, .09]])
+LOWER = np.zeros(2)
+UPPER = np.ones(2)
+
+
+@pytest.mark.parametrize('bounds', ['reject', 'batch', 'reflect'])
+def test_candidates_inside_bounds(bounds):
+    ra.seed_generator(1)
+    proposal = Proposal(COV, 1.0, LOWER, UPPER, bounds)
+    leaders = ra.uniformrand(0, 1, size=(500, 2))
+    candidates = proposal.propose_all(leaders)
+    assert np.all(proposal.inside(candidates))
+    for leader in leaders[:50]:
+        assert proposal.inside(proposal(leader))
+    assert proposal.nproposals == 550
+    assert proposal.ndraws >= proposal.nproposals
+
+
+@pytest.mark.parametrize('bounds', ['reject', 'batch'])
+def test_truncated_modes_have_no_correction(bounds):
+    proposal = Proposal(COV, 1.0, LOWER, UPPER, bounds)
+    x = np.array([[0.1, 0.1], [0.5, 0.5]])
+    y = np.array([[0.3, 0.05], [0.6, 0.4]])
+    assert np.all(proposal.log_ratio(x, y) == 0)
+    assert proposal.log_ratio(x[0], y[0]) == 0
+
+
+def test_reflected_density_is_normalized():
+    proposal = Proposal(COV, 1.0, LOWER, UPPER, 'reflect')
+    norm = -0.5 * np.log(np.linalg.det(2 * np.pi * COV))
+    grid = (np.arange(200) + 0.5) / 200
+    y = np.array(np.meshgrid(grid, grid)).reshape(2, -1).T
+    for leader in ([0.1, 0.1], [0.9, 0.2], [0.5, 0.5]):
+        x = np.tile(leader, (len(y), 1))
+        r = y - x
+        q = np.exp(proposal.log_image_sum(x, y) + norm - 0.5 * np.einsum(
+            'nd,de,ne->n', r, proposal.precision, r))
+        assert np.mean(q) == pytest.approx(1, abs=1e-3)
+
+
+def test_reflect_correction_is_antisymmetric():
+    proposal = Proposal(COV, 1.0, LOWER, UPPER, 'reflect')
+    x = np.array([0.1, 0.1])
+    y = np.array([0.3, 0.05])
+    ratio = proposal.log_ratio(x, y)
+    # the folded proposal itself is not symmetric near the corner
+    assert abs(ratio) > 0.5
+    assert proposal.log_ratio(y, x) == pytest.approx(-ratio)
+    # far from the bounds no mirror image contributes
+    proposal = Proposal(0.01 * COV, 1.0, LOWER, UPPER, 'reflect')
+    assert proposal.log_ratio([0.5, 0.5], [0.55, 0.52]) == 0
+
+
+def test_reflect_samples_uniform_target():
+    """ Metropolis-Hastings with the reflected proposal and its correction
+        keeps the uniform distribution on the box invariant. """
+    ra.seed_generator(2)
+    proposal = Proposal(COV, 1.0, LOWER, UPPER, 'reflect')
+    n = 2000
+    points = ra.uniformrand(0, 1, size=(n, 2))
+    samples = []
+    for step in range(150):
+        candidates = proposal.propose_all(points)
+        accept = np.log(ra.uniformrand(0, 1, size=n)) < \
+            proposal.log_ratio(points, candidates)
+        points[accept] = candidates[accept]
+        if step >= 50:
+            samples.append(points.copy())
+    counts, _, _ = np.histogram2d(*np.concatenate(samples).T, bins=4,
+                                  range=[[0, 1], [0, 1]])
+    # without the correction the corner bins are off by more than 100 %
+    assert np.all(np.abs(counts / counts.mean() - 1) < 0.15)
+
+
+def brute_force_log_ratio(proposal, x, y, coordinates):
+    """ Reflect correction summed over every combination of the images
+        -y, y and 2 - y of the given coordinates """
+    def logq(x, y):
+        images = np.array(list(itertools.product((-1, 1, 2), repeat=len(
+            coordinates))))
+        points = np.tile(y, (len(images), 1))
+        points[:, coordinates] = np.where(images == 2, 2 - y[coordinates],
+                                          images * y[coordinates])
+        r = points - x
+        return np.logaddexp.reduce(-0.5 * np.einsum(
+            'nd,de,ne->n', r, proposal.precision, r))
+    return logq(y, x) - logq(x, y)
+
+
+def test_reflect_correction_in_high_dimension():
+    ra.seed_generator(3)
+    rng = np.random.default_rng(3)
+    d, n = 12, 2000
+    cov = 0.0025 * (0.5 * np.eye(d) + 0.5 * np.ones((d, d)))
+    proposal = Proposal(cov, 1.0, np.zeros(d), np.ones(d), 'reflect')
+    # three coordinates of every other leader near a bound, the rest of
+    # the leaders in the middle of the box
+    x = rng.uniform(0.45, 0.55, size=(n, d))
+    near = np.argsort(rng.uniform(size=(n, d)), axis=1)[::2, :3]
+    x[np.arange(0, n, 2)[:, None], near] = rng.choice(
+        [0.02, 0.98], size=near.shape) + rng.uniform(-0.02, 0.02, near.shape)
+    y = proposal.propose_all(x)
+
+    ratio = proposal.log_ratio(x, y)
+    assert np.all(ratio[1::2] == 0)
+    expected = [brute_force_log_ratio(proposal, x[i], y[i], near[i // 2])
+                for i in range(0, n, 2)]
+    np.testing.assert_allclose(ratio[::2], expected, atol=1e-10)
+    assert np.std(ratio[::2]) > 0.1
+
+
+def test_reflect_correction_near_every_bound():
+    """ With every coordinate near the bounds the number of mirror images
+        grows as 3^d; the correction keeps the heaviest combinations. """
+    ra.seed_generator(4)
+    d, n = 12, 2000
+    cov = 0.01 * (0.5 * np.eye(d) + 0.5 * np.ones((d, d)))
+    proposal = Proposal(cov, 1.0, np.zeros(d), np.ones(d), 'reflect')
+    x = ra.uniformrand(0, 1, size=(n, d))
+    y = proposal.propose_all(x)
+    start = time.perf_counter()
+    ratio = proposal.log_ratio(x, y)
+    assert time.perf_counter() - start < 20
+    np.testing.assert_allclose(proposal.log_ratio(y, x), -ratio)
+    for i in range(5):
+        assert proposal.log_ratio(x[i], y[i]) == pytest.approx(ratio[i])
+    # a diagonal covariance folds symmetrically
+    proposal = Proposal(np.diag(np.diag(cov)), 1.0, np.zeros(d), np.ones(d),
+                        'reflect')
+    assert np.all(proposal.log_ratio(x, y) == 0)